@@ -8,37 +8,63 @@ automation_steps_revised.py
 from __future__ import annotations
 import re
 import os
+import sys
 import random
 import hashlib
+import pickle
+from pathlib import Path
 from collections import defaultdict
 from typing import Dict, List, Tuple, Optional, Set
 from io import BytesIO
 
 import gspread
-from gspread.cell import Cell
 from gspread.utils import rowcol_to_a1
-from gspread.exceptions import WorksheetNotFound
+from gspread.exceptions import WorksheetNotFound, APIError
 import pandas as pd
 
 
 from .utils_common import (
     load_env, with_retry, safe_worksheet, header_key, top_of_category,
-    get_tem_sheet_name, get_env, get_bool_env, hex_to_rgb01, strip_category_id
+    get_tem_sheet_name, get_env, get_bool_env, hex_to_rgb01, strip_category_id,
+    evict_worksheet_cache
 )
 
 # ==============================================================================
 # 공통 헬퍼 함수
 # ==============================================================================
 
+# 옵션명/브랜드명 정규화용 공백 축약 패턴 (핫루프에서 재컴파일 방지)
+_WS_RE = re.compile(r"\s+")
+
+_EMPTY_MAP: Dict[str, str] = {}
+
+
+def _norm_opt(s: str) -> str:
+    """옵션명 비교용 정규화: 소문자 + 공백 압축. split/join은 C 루프라 정규식보다 빠르다."""
+    return " ".join(s.lower().split())
+
+_HDR_KEYS_CACHE: Dict[tuple, List[str]] = {}
+
+def _header_keys(cells: List[str]) -> List[str]:
+    """동일한 헤더 행이 카테고리 블록마다 반복되므로 header_key 결과 리스트를 캐시/재사용"""
+    key = tuple(cells)
+    cached = _HDR_KEYS_CACHE.get(key)
+    if cached is None:
+        cached = _HDR_KEYS_CACHE[key] = [header_key(h) for h in cells]
+    return cached
+
 def _pick_index_by_candidates(header_row: List[str], candidates: List[str]) -> int:
     """헤더 행에서 후보명(정규화)으로 가장 그럴듯한 인덱스 찾기 (정확 > 부분 일치)"""
     keys = [header_key(x) for x in header_row]
-    # 정확 일치
+    # 정확 일치: 키→인덱스 dict를 한 번 만들어 O(1) 조회 (첫 등장 인덱스 유지)
+    exact = {}
+    for i, k in enumerate(keys):
+        if k and k not in exact:
+            exact[k] = i
     for cand in candidates:
-        ck = header_key(cand)
-        for i, k in enumerate(keys):
-            if k == ck:
-                return i
+        i = exact.get(header_key(cand), -1)
+        if i >= 0:
+            return i
     # 부분 일치
     for cand in candidates:
         ck = header_key(cand)
@@ -63,26 +89,91 @@ def _find_col_index(keys: List[str], name: str, extra_alias: List[str]=[]) -> in
             return i
     return -1
 
+def _values_unformatted(ws, a1_range: str = "A:ZZ") -> List[List]:
+    """
+    get_all_values() 대신 UNFORMATTED_VALUE로 읽기.
+    로캘 포맷(천 단위 콤마 등) 없이 원시 값이 내려와 와이어 크기와 파싱 비용이 줄어든다.
+    숫자 셀은 int/float로 오므로 사용처에서 str() 코어션 필요.
+    a1_range로 필요한 열만 좁혀 읽으면 전송량이 열 비율만큼 줄어든다.
+    """
+    resp = with_retry(lambda: ws.spreadsheet.values_get(
+        f"{ws.title}!{a1_range}",
+        params={'valueRenderOption': 'UNFORMATTED_VALUE', 'majorDimension': 'ROWS'},
+    ))
+    return resp.get('values', [])
+
+
+def _header_rows(vals: List[List[str]]) -> List[int]:
+    """TEM 행렬에서 'category' 헤더 행 인덱스 목록 (블록 경계)"""
+    return [
+        i for i, row in enumerate(vals)
+        if len(row) > 1 and row[1].strip().lower() == "category"
+    ]
+
+
+def _set_val(vals: List[List[str]], r0: int, c0: int, value: str) -> None:
+    """2D 값 행렬의 (r0, c0) 0-based 위치에 기록. 짧은 행은 빈 칸으로 확장."""
+    row = vals[r0]
+    if len(row) <= c0:
+        row.extend([""] * (c0 + 1 - len(row)))
+    row[c0] = value
+
+
+def _flush_matrix(tem_ws, vals: List[List[str]]) -> None:
+    """
+    메모리에서 수정한 TEM 행렬 전체를 단일 values.update로 기록.
+    셀 단위 batchUpdate(수만 개 JSON 오브젝트) 대비 왕복 1회 + 밀집 페이로드.
+    RAW로 기록해 기존 셀 값이 재해석(예: '1-2' → 날짜)되지 않도록 한다.
+    """
+    if not vals:
+        return
+    max_cols = max((len(r) for r in vals), default=0)
+    end_a1 = rowcol_to_a1(len(vals), max_cols)
+    with_retry(lambda: tem_ws.update(values=vals, range_name=f"A1:{end_a1}", value_input_option="RAW"))
+
+
+# 스텝들이 쌓는 실패 행 버퍼. 스텝마다 Failures 탭을 읽고 쓰는 대신
+# flush_failures가 파이프라인 끝에 1회 append한다.
+_FAILURE_BUFFER: List[List[str]] = []
+
+
 def _append_failures(sh, rows: List[List[str]]):
-    """Failures 탭에 rows를 append. 공간 부족 시 자동 resize."""
-    if not rows:
+    """실패 행을 버퍼에 누적. 실제 기록은 flush_failures가 일괄 수행."""
+    if rows:
+        _FAILURE_BUFFER.extend(rows)
+
+
+def flush_failures(sh):
+    """
+    버퍼에 쌓인 실패 행을 Failures 탭에 1회 append.
+    values.append(INSERT_ROWS)는 마지막 데이터 행을 서버가 찾고 필요 시 시트를
+    자동 확장하므로, 기존의 전체 읽기 + resize + update 3회 호출이 1회로 줄어든다.
+    """
+    if not _FAILURE_BUFFER:
         return
+    rows = _FAILURE_BUFFER[:]
+    del _FAILURE_BUFFER[:]
     try:
         ws = safe_worksheet(sh, "Failures")
-        vals = with_retry(lambda: ws.get_all_values()) or []
-        start_row = len(vals) + 1
-        end_row = start_row + len(rows) - 1
-
-        if end_row > ws.row_count:
-            with_retry(lambda: ws.resize(rows=end_row + 100, cols=max(ws.col_count, 10)))
-
-        with_retry(lambda: ws.update(values=rows, range_name=f"A{start_row}"))
+        with_retry(lambda: ws.append_rows(
+            rows, value_input_option="RAW", insert_data_option="INSERT_ROWS", table_range="A1"))
 
     except WorksheetNotFound:
          # 시트가 아예 없는 경우 새로 만듦 (main_controller에서 초기화하지만 안전장치)
         ws = with_retry(lambda: sh.add_worksheet(title="Failures", rows=1000, cols=10))
         header = [["PID","Category","Name","Reason","Detail"]]
         with_retry(lambda: ws.update(values=header + rows, range_name="A1"))
+    except APIError:
+        # 캐시된 핸들이 가리키던 탭이 밖에서 삭제된 경우 → 캐시 비우고 1회 재조회
+        evict_worksheet_cache(sh, "Failures")
+        try:
+            ws = safe_worksheet(sh, "Failures")
+            with_retry(lambda: ws.append_rows(
+                rows, value_input_option="RAW", insert_data_option="INSERT_ROWS", table_range="A1"))
+        except WorksheetNotFound:
+            ws = with_retry(lambda: sh.add_worksheet(title="Failures", rows=1000, cols=10))
+            header = [["PID","Category","Name","Reason","Detail"]]
+            with_retry(lambda: ws.update(values=header + rows, range_name="A1"))
 
 
 # ==============================================================================
@@ -100,10 +191,20 @@ def run_step_1(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
     ref_sheet = get_env("TEMPLATE_DICT_SHEET_NAME", "TemplateDict")
     tem_name = get_tem_sheet_name()
 
-    basic_ws = safe_worksheet(sh, "BASIC")
-    media_ws = safe_worksheet(sh, "MEDIA")
-    basic_vals = with_retry(lambda: basic_ws.get_all_values())
-    media_vals = with_retry(lambda: media_ws.get_all_values())
+    # BASIC/MEDIA/SALES를 batchGet 1회로 읽어 왕복을 3회 → 1회로 줄임.
+    # SALES 탭이 없으면 전체 호출이 실패하므로 필수 탭(BASIC/MEDIA)만으로 폴백.
+    sales_vals: List[List[str]] = []
+    try:
+        resp = with_retry(lambda: sh.values_batch_get(ranges=["BASIC!A:ZZ", "MEDIA!A:ZZ", "SALES!A:ZZ"]))
+        vranges = resp.get("valueRanges", [])
+        basic_vals = vranges[0].get("values", []) if len(vranges) > 0 else []
+        media_vals = vranges[1].get("values", []) if len(vranges) > 1 else []
+        sales_vals = vranges[2].get("values", []) if len(vranges) > 2 else []
+    except Exception:
+        resp = with_retry(lambda: sh.values_batch_get(ranges=["BASIC!A:ZZ", "MEDIA!A:ZZ"]))
+        vranges = resp.get("valueRanges", [])
+        basic_vals = vranges[0].get("values", []) if len(vranges) > 0 else []
+        media_vals = vranges[1].get("values", []) if len(vranges) > 1 else []
 
     if len(basic_vals) < basic_header or len(media_vals) < media_header:
         print("[!] BASIC or MEDIA 시트가 비어 있습니다.")
@@ -145,10 +246,9 @@ def run_step_1(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
     media_hdr = parse_media_header_row(media_vals[media_header - 1])
 
     parent_sku_map: dict[str, str] = {}
-    sku_by_pid_opt: dict[tuple[str, str], str] = {}
+    # pid → {정규화된 옵션명 → sku}: 조회 시 짧은 pid 해시 1회 + 옵션명 해시 1회
+    sku_by_pid_opt: dict[str, dict[str, str]] = {}
     try:
-        sales_ws = safe_worksheet(sh, "SALES")
-        sales_vals = with_retry(lambda: sales_ws.get_all_values()) or []
         if sales_vals:
             hdr = sales_vals[0]
             pid_idx = _pick_index_by_candidates(hdr, ["product id","pid","item id","et_title_product_id"])
@@ -157,34 +257,59 @@ def run_step_1(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
             sku_idx = _pick_index_by_candidates(hdr, ["sku","variation sku","child sku","option sku","seller_child_sku","et_title_child_sku"])
             
             if pid_idx >= 0:
+                # 핫루프 hoist: 열 존재 여부는 루프 밖에서 한 번만 판정
+                need_psku = psku_idx >= 0
+                need_sku = var_name_idx >= 0 and sku_idx >= 0
                 for r in range(1, len(sales_vals)):
                     row = sales_vals[r]
-                    pid = (row[pid_idx] if pid_idx < len(row) else "").strip()
+                    n = len(row)
+                    pid = (row[pid_idx] if pid_idx < n else "").strip()
                     if not pid: continue
-                    if 0 <= psku_idx < len(row) and (row[psku_idx] or "").strip():
+                    if need_psku and psku_idx < n and (row[psku_idx] or "").strip():
                         parent_sku_map[pid] = row[psku_idx].strip()
-                    if 0 <= var_name_idx < len(row) and 0 <= sku_idx < len(row):
+                    if need_sku and var_name_idx < n and sku_idx < n:
                         vname = (row[var_name_idx] or "").strip()
                         sku = (row[sku_idx] or "").strip()
                         if vname and sku:
-                            sku_by_pid_opt[(pid, re.sub(r"\s+", " ", vname.lower()))] = sku
+                            sku_by_pid_opt.setdefault(pid, {})[_norm_opt(vname)] = sku
     except Exception as e:
         print(f"[SKU][WARN] SALES 탭 처리 스킵: {e}")
     
     buckets: Dict[str, Dict[str, List]] = {}
     failures: List[List[str]] = []
-    
-    def set_if_exists(headers: List[str], row: List[str], name: str, value: str):
-        idx = _find_col_index([header_key(h) for h in headers], name)
-        if idx >= 0: row[idx] = value
-    
+
+    # top_norm별 필드명→열 인덱스 플랜: _find_col_index 탐색을 버킷당 1회로 줄임
+    hdr_plan: Dict[str, Dict[str, int]] = {}
+    hdr_keys_by_top: Dict[str, List[str]] = {}
+
+    def set_field(top_norm: str, row: List[str], name: str, value: str):
+        # row는 [pid, ...헤더 열들] 레이아웃이므로 헤더 인덱스에 +1
+        plan = hdr_plan[top_norm]
+        idx = plan.get(name)
+        if idx is None:
+            idx = plan[name] = _find_col_index(hdr_keys_by_top[top_norm], name)
+        if idx >= 0: row[idx + 1] = value
+
+    # 아이템 이미지 필드명은 열 구성이 고정이므로 행 루프 밖에서 한 번만 포맷
+    item_img_fields = tuple(f"item image {k}" for k in range(1, len(media_hdr.item_images) + 1))
+    # top_norm별 item image 열 인덱스: 행 루프에서는 리스트 인덱싱만 남긴다
+    item_img_cols_by_top: Dict[str, List[int]] = {}
+
+    # 카테고리 문자열은 행마다 크게 반복되므로 raw cat → (top_norm, headers) 캐시
+    cat_cache: Dict[str, Tuple[str, Optional[List[str]]]] = {}
+
     for r in range(media_first - 1, len(media_vals)):
         row = media_vals[r]
+        # 소비한 MEDIA 행은 즉시 해제: buckets가 사실상 두 번째 복사본을 들고 있으므로
+        # 참조를 끊어 피크 메모리를 원본 한 벌 수준으로 유지
+        media_vals[r] = None
         pid = (row[media_hdr.pid] or "").strip() if media_hdr.pid >= 0 and len(row)>media_hdr.pid else ""
         cat = (row[media_hdr.category] or "").strip() if media_hdr.category >= 0 and len(row)>media_hdr.category else ""
         if not pid or not cat: continue
         
-        pname = (row[media_hdr.pname] if media_hdr.pname >= 0 else "") or ""
+        # batchGet 원시 값은 행 끝의 빈 셀을 잘라내므로(get_all_values와 달리
+        # 직사각형 패딩 없음) 모든 열 접근에 길이 가드가 필요하다
+        pname = (row[media_hdr.pname] if 0 <= media_hdr.pname < len(row) else "") or ""
         item_imgs = [(row[i] or "").strip() for i in media_hdr.item_images if i < len(row)]
         
         options = []
@@ -196,51 +321,62 @@ def run_step_1(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
                 img_val = (row[media_hdr.opt_img_cols[i]] if media_hdr.opt_img_cols[i] < len(row) else "").strip()
             options.append((opt_name, img_val))
 
-        top_norm = header_key(top_of_category(cat) or "")
-        headers = template_dict.get(top_norm)
+        cached = cat_cache.get(cat)
+        if cached is None:
+            top_norm = header_key(top_of_category(cat) or "")
+            cached = cat_cache[cat] = (top_norm, template_dict.get(top_norm))
+        top_norm, headers = cached
         if not headers:
             failures.append([pid, cat, pname, "TEMPLATE_TOPLEVEL_NOT_FOUND", f"top={top_of_category(cat)}"])
             continue
 
+        if top_norm not in hdr_plan:
+            hdr_plan[top_norm] = {}
+            keys = hdr_keys_by_top[top_norm] = _header_keys(headers)
+            # pid 열을 포함한 최종 행 기준 인덱스(+1)로 저장
+            cols = [_find_col_index(keys, f) for f in item_img_fields]
+            item_img_cols_by_top[top_norm] = [c + 1 if c >= 0 else -1 for c in cols]
+        item_img_cols = item_img_cols_by_top[top_norm]
+
         psku_val = parent_sku_map.get(pid, "")
-        
+
         if not options:
-            arr = [""] * len(headers)
-            set_if_exists(headers, arr, "category", cat)
-            set_if_exists(headers, arr, "product name", pname)
-            for k, url in enumerate(item_imgs, start=1):
-                if url: set_if_exists(headers, arr, f"item image {k}", url)
-            if psku_val: set_if_exists(headers, arr, "parent sku", psku_val)
-            b = buckets.setdefault(top_norm, {"headers": headers, "pids": [], "rows": []})
-            b["pids"].append([pid]); b["rows"].append(arr)
+            # 행을 처음부터 [pid, ...] 레이아웃으로 만들어 flatten 단계의 리스트 연결을 없앰
+            arr = [""] * (len(headers) + 1)
+            arr[0] = pid
+            set_field(top_norm, arr, "category", cat)
+            set_field(top_norm, arr, "product name", pname)
+            for c, url in zip(item_img_cols, item_imgs):
+                if c > 0 and url: arr[c] = url
+            if psku_val: set_field(top_norm, arr, "parent sku", psku_val)
+            buckets.setdefault(top_norm, {"headers": headers, "rows": []})["rows"].append(arr)
         else:
-            var_label_val = (row[media_hdr.var_label] if media_hdr.var_label >= 0 else "") or "color"
+            var_label_val = (row[media_hdr.var_label] if 0 <= media_hdr.var_label < len(row) else "") or "color"
+            opt_sku_map = sku_by_pid_opt.get(pid, _EMPTY_MAP)
             for (opt_name_raw, opt_img) in options:
-                arr = [""] * len(headers)
-                set_if_exists(headers, arr, "category", cat)
-                set_if_exists(headers, arr, "product name", pname)
-                set_if_exists(headers, arr, "variation name1", var_label_val)
-                set_if_exists(headers, arr, "option for variation 1", opt_name_raw)
-                if opt_img: set_if_exists(headers, arr, "image per variation", opt_img)
-                for k, url in enumerate(item_imgs, start=1):
-                    if url: set_if_exists(headers, arr, f"item image {k}", url)
-                if psku_val: set_if_exists(headers, arr, "parent sku", psku_val)
-
-                opt_key = (pid, re.sub(r"\s+", " ", opt_name_raw.lower()))
-                csku_val = sku_by_pid_opt.get(opt_key, "")
+                arr = [""] * (len(headers) + 1)
+                arr[0] = pid
+                set_field(top_norm, arr, "category", cat)
+                set_field(top_norm, arr, "product name", pname)
+                set_field(top_norm, arr, "variation name1", var_label_val)
+                set_field(top_norm, arr, "option for variation 1", opt_name_raw)
+                if opt_img: set_field(top_norm, arr, "image per variation", opt_img)
+                for c, url in zip(item_img_cols, item_imgs):
+                    if c > 0 and url: arr[c] = url
+                if psku_val: set_field(top_norm, arr, "parent sku", psku_val)
+
+                csku_val = opt_sku_map.get(_norm_opt(opt_name_raw), "")
                 if csku_val:
-                    set_if_exists(headers, arr, "sku", csku_val)
+                    set_field(top_norm, arr, "sku", csku_val)
                 else:
                     failures.append([pid, cat, pname, "SKU_MATCH_NOT_FOUND", f"opt={opt_name_raw}"])
-                
-                b = buckets.setdefault(top_norm, {"headers": headers, "pids": [], "rows": []})
-                b["pids"].append([pid]); b["rows"].append(arr)
+
+                buckets.setdefault(top_norm, {"headers": headers, "rows": []})["rows"].append(arr)
 
     out_matrix: List[List[str]] = []
     for _, pack in buckets.items():
         out_matrix.append([""] + pack["headers"])
-        for pid_row, data_row in zip(pack["pids"], pack["rows"]):
-            out_matrix.append(pid_row + data_row)
+        out_matrix.extend(pack["rows"])
 
     if out_matrix:
         try:
@@ -266,47 +402,96 @@ def run_step_1(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
 # STEP 2: Mandatory 기본값 채우기
 # ==============================================================================
 
-def run_step_2(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
-    """Step 2: TEM_OUTPUT에 Mandatory 기본값 채우기 + 색칠"""
-    print("\n[ Automation ] Starting Step 2: Fill Mandatory Defaults...")
+# 참조 시트(MandatoryDefaults_* / cat props)는 거의 바뀌지 않으므로
+# modifiedTime을 키로 로컬 pickle에 캐시하여 전체 재독을 생략한다.
+_REF_CACHE_DIR = Path(os.path.expanduser("~/.cache/shopee"))
 
-    tem_name = get_tem_sheet_name()
-    color_hex = get_env("COLOR_HEX_MANDATORY", "#FFF9C4")
-    overwrite = get_bool_env("OVERWRITE_NONEMPTY", False)
 
+def _ref_modified_time(ref: gspread.Spreadsheet) -> Optional[str]:
+    """Drive 메타데이터의 modifiedTime (실패 시 None → 캐시 미사용)
+
+    lastUpdateTime 프로퍼티는 초기화 시점 값만 반환(+deprecated)하므로
+    매번 Drive를 조회하는 get_lastUpdateTime()을 쓴다 — 참조 시트 핸들이
+    프로세스 수명 동안 캐시되어도 수정이 제대로 감지된다.
+    """
     try:
-        tem_ws = safe_worksheet(sh, tem_name)
-    except WorksheetNotFound:
-        print(f"[!] {tem_name} 탭 없음. Step1 선행 필요."); return
+        return with_retry(lambda: ref.get_lastUpdateTime())
+    except Exception:
+        return None
 
-    def _read_defaults_ws(ws):
-        vals = with_retry(lambda: ws.get_all_values()) or []
-        if not vals: return {}
-        keys = [header_key(x) for x in vals[0]]
-        c_idx = _find_col_index(keys, "category")
-        a_idx = _find_col_index(keys, "attribute", ["attr", "property"])
-        d_idx = _find_col_index(keys, "defaultvalue", ["default"])
-        if min(c_idx, a_idx, d_idx) < 0: return {}
-        
-        out = {}
-        for r in range(1, len(vals)):
-            row = vals[r]
-            cat = (row[c_idx] if c_idx < len(row) else "").strip()
-            attr = (row[a_idx] if a_idx < len(row) else "").strip()
-            dval = (row[d_idx] if d_idx < len(row) else "").strip()
-            if cat and attr:
-                out.setdefault((cat or "").strip().lower(), {})[header_key(attr)] = dval
-        return out
 
+def _ref_cache_path(ref_id: str, mtime: str) -> Path:
+    safe = re.sub(r"[^A-Za-z0-9]+", "", str(mtime))
+    return _REF_CACHE_DIR / f"{ref_id}-{safe}.pkl"
+
+
+def _load_ref_cache(path: Path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+
+def _save_ref_cache(ref_id: str, path: Path, payload) -> None:
+    """캐시는 best-effort: 실패해도 자동화에 영향 없음. 같은 ref의 옛 mtime 캐시는 제거."""
+    try:
+        _REF_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for old in _REF_CACHE_DIR.glob(f"{ref_id}-*.pkl"):
+            if old != path:
+                old.unlink(missing_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+
+def _read_defaults_vals(vals):
+    """MandatoryDefaults_* 탭 값 → {category(lower): {attr_key: default}}"""
+    if not vals: return {}
+    keys = [header_key(x) for x in vals[0]]
+    c_idx = _find_col_index(keys, "category")
+    a_idx = _find_col_index(keys, "attribute", ["attr", "property"])
+    d_idx = _find_col_index(keys, "defaultvalue", ["default"])
+    if min(c_idx, a_idx, d_idx) < 0: return {}
+
+    out = {}
+    for r in range(1, len(vals)):
+        row = vals[r]
+        cat = (row[c_idx] if c_idx < len(row) else "").strip()
+        attr = (row[a_idx] if a_idx < len(row) else "").strip()
+        dval = (row[d_idx] if d_idx < len(row) else "").strip()
+        if cat and attr:
+            out.setdefault((cat or "").strip().lower(), {})[header_key(attr)] = dval
+    return out
+
+
+def _prep_step_2(ref: gspread.Spreadsheet):
+    """Step 2 참조 데이터 로드 (pickle 캐시 → batchGet 순)"""
+    mtime = _ref_modified_time(ref)
+    cache_path = _ref_cache_path(ref.id, mtime) if mtime else None
+    cached = _load_ref_cache(cache_path) if (cache_path and cache_path.exists()) else None
+
+    if cached:
+        print(f"[ INFO ] 참조 캐시 사용 (modifiedTime={mtime})")
+        return cached
+
+    # MandatoryDefaults_* 전체 + cat props를 batchGet 1회로 읽음 (탭당 1회 왕복 제거)
     sheets = with_retry(lambda: ref.worksheets())
+    md_titles = [ws.title for ws in sheets if ws.title.lower().startswith("mandatorydefaults_")]
+    cat_props_title = get_env("CAT_PROPS_SHEET", "cat props")
+    ranges = [f"'{t}'!A:ZZ" for t in md_titles + [cat_props_title]]
+    resp = with_retry(lambda: ref.values_batch_get(ranges=ranges))
+    vranges = resp.get("valueRanges", [])
+
     defaults_map = {}
-    for ws in sheets:
-        if ws.title.lower().startswith("mandatorydefaults_"):
-            for k, d in _read_defaults_ws(ws).items():
-                defaults_map.setdefault(k, {}).update(d)
+    for vr in vranges[:len(md_titles)]:
+        for k, d in _read_defaults_vals(vr.get("values", [])).items():
+            defaults_map.setdefault(k, {}).update(d)
 
-    cat_props_ws = safe_worksheet(ref, get_env("CAT_PROPS_SHEET", "cat props"))
-    cat_props_vals = with_retry(lambda: cat_props_ws.get_all_values()) or []
+    cat_props_vals = vranges[len(md_titles)].get("values", []) if len(vranges) > len(md_titles) else []
     catprops_map = {}
     if cat_props_vals:
         hdr_keys = [header_key(x) for x in cat_props_vals[0]]
@@ -314,24 +499,32 @@ def run_step_2(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
             row = cat_props_vals[r]
             cat_raw = (row[0] if len(row) > 0 else "").strip()
             if not cat_raw: continue
-            mand_list = [hdr_keys[j] for j, cell in enumerate(row) if str(cell).strip().lower() == "mandatory"]
+            # 데이터 행이 (끝이 잘린) 헤더 행보다 길 수 있으므로 j 범위를 가드
+            mand_list = [hdr_keys[j] for j, cell in enumerate(row)
+                         if j < len(hdr_keys) and str(cell).strip().lower() == "mandatory"]
             if mand_list: catprops_map[(cat_raw or "").strip().lower()] = mand_list
 
-    vals = with_retry(lambda: tem_ws.get_all_values()) or []
-    if not vals: print("[!] TEM_OUTPUT 비어 있음."); return
+    if cache_path:
+        _save_ref_cache(ref.id, cache_path, (defaults_map, catprops_map))
+    return defaults_map, catprops_map
 
-    meta = with_retry(lambda: sh.fetch_sheet_metadata())
-    sheet_id = next((s["properties"]["sheetId"] for s in meta["sheets"] if s["properties"]["title"] == tem_name), None)
-    if sheet_id is None: print("[!] 시트 ID 찾지 못함."); return
 
-    updates: List[Cell] = []
+def _apply_step_2(vals: List[List[str]], defaults_map, catprops_map, overwrite: bool):
+    """Step 2 본체: vals를 제자리 수정. (채운 셀 수, 색칠 대상 {col: [span,...]}) 반환"""
     color_ranges_by_col = defaultdict(list)
     current_hdr_keys = None
     total_filled = 0
 
+    # 같은 블록 안에서는 카테고리별 (열, 기본값) 플랜을 한 번만 계산한다.
+    # _find_col_index 탐색이 행 수 × 속성 수에서 카테고리 수 × 속성 수로 줄어든다.
+    fill_plan_cache: Dict[str, List[Tuple[int, str]]] = {}
+    color_plan_cache: Dict[str, List[int]] = {}
+
     for r0, row in enumerate(vals):
         if (row[1] if len(row) > 1 else "").strip().lower() == "category":
-            current_hdr_keys = [header_key(h) for h in row[1:]]
+            current_hdr_keys = _header_keys(row[1:])
+            fill_plan_cache = {}
+            color_plan_cache = {}
             continue
         if not current_hdr_keys: continue
 
@@ -340,40 +533,102 @@ def run_step_2(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
         if not pid or not cat_raw: continue
         norm_cat = (cat_raw or "").strip().lower()
 
-        if norm_cat in catprops_map:
-            for attr_norm in catprops_map[norm_cat]:
-                j = _find_col_index(current_hdr_keys, attr_norm)
-                if j >= 0: color_ranges_by_col[j].append((r0, r0 + 1))
-        
-        if norm_cat in defaults_map:
-            for attr_norm, dval in defaults_map[norm_cat].items():
-                if not dval: continue
-                j = _find_col_index(current_hdr_keys, attr_norm)
-                if j < 0: continue
-                col_1based = j + 2
-                cur = (row[col_1based - 1] if len(row) >= col_1based else "").strip()
-                if not cur or overwrite:
-                    updates.append(Cell(row=r0 + 1, col=col_1based, value=dval))
-                    total_filled += 1
-
-    if updates:
-        with_retry(lambda: tem_ws.update_cells(updates, value_input_option="RAW"))
-
-    def _merge(spans):
-        if not spans: return []
-        spans.sort(); merged = [spans[0]]
-        for s, e in spans[1:]:
-            ls, le = merged[-1]
-            if s <= le: merged[-1] = (ls, max(le, e))
-            else: merged.append((s, e))
-        return merged
-
-    requests = []
+        color_cols = color_plan_cache.get(norm_cat)
+        if color_cols is None:
+            color_cols = color_plan_cache[norm_cat] = [
+                j for attr_norm in catprops_map.get(norm_cat, ())
+                if (j := _find_col_index(current_hdr_keys, attr_norm)) >= 0
+            ]
+        for j in color_cols:
+            color_ranges_by_col[j].append((r0, r0 + 1))
+
+        fill_plan = fill_plan_cache.get(norm_cat)
+        if fill_plan is None:
+            fill_plan = fill_plan_cache[norm_cat] = [
+                (j + 2, dval) for attr_norm, dval in defaults_map.get(norm_cat, {}).items()
+                if dval and (j := _find_col_index(current_hdr_keys, attr_norm)) >= 0
+            ]
+        for col_1based, dval in fill_plan:
+            cur = (row[col_1based - 1] if len(row) >= col_1based else "").strip()
+            if not cur or overwrite:
+                _set_val(vals, r0, col_1based - 1, dval)
+                total_filled += 1
+
+    return total_filled, color_ranges_by_col
+
+
+def _merge_spans(spans):
+    if not spans: return []
+    spans.sort(); merged = [spans[0]]
+    for s, e in spans[1:]:
+        ls, le = merged[-1]
+        if s <= le: merged[-1] = (ls, max(le, e))
+        else: merged.append((s, e))
+    return merged
+
+
+def _step2_format_requests(sheet_id: int, color_ranges_by_col, color_hex: str):
+    """
+    색칠 요청 생성. 동일한 행 span 집합을 공유하는 열끼리 묶은 뒤
+    인접 열 run을 하나의 2D 범위로 병합해 repeatCell 수를 크게 줄인다.
+    """
     color = hex_to_rgb01(color_hex)
+    spans_to_cols: Dict[tuple, List[int]] = defaultdict(list)
     for j, spans in color_ranges_by_col.items():
-        for s, e in _merge(spans):
-            requests.append({"repeatCell": {"range": {"sheetId": sheet_id, "startRowIndex": s, "endRowIndex": e, "startColumnIndex": 1 + j, "endColumnIndex": 1 + j + 1}, "cell": {"userEnteredFormat": {"backgroundColor": color}}, "fields": "userEnteredFormat.backgroundColor"}})
-    
+        spans_to_cols[tuple(_merge_spans(spans))].append(j)
+
+    requests = []
+    for spans, cols in spans_to_cols.items():
+        cols.sort()
+        # 연속 열 run으로 분할
+        run_start = prev = cols[0]
+        runs = []
+        for c in cols[1:]:
+            if c == prev + 1:
+                prev = c
+                continue
+            runs.append((run_start, prev))
+            run_start = prev = c
+        runs.append((run_start, prev))
+
+        for c0, c1 in runs:
+            for s, e in spans:
+                requests.append({"repeatCell": {"range": {"sheetId": sheet_id, "startRowIndex": s, "endRowIndex": e, "startColumnIndex": 1 + c0, "endColumnIndex": 1 + c1 + 1}, "cell": {"userEnteredFormat": {"backgroundColor": color}}, "fields": "userEnteredFormat.backgroundColor"}})
+    return requests
+
+
+def _tem_sheet_id(sh: gspread.Spreadsheet, tem_name: str) -> Optional[int]:
+    meta = with_retry(lambda: sh.fetch_sheet_metadata())
+    return next((s["properties"]["sheetId"] for s in meta["sheets"] if s["properties"]["title"] == tem_name), None)
+
+
+def run_step_2(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
+    """Step 2: TEM_OUTPUT에 Mandatory 기본값 채우기 + 색칠"""
+    print("\n[ Automation ] Starting Step 2: Fill Mandatory Defaults...")
+
+    tem_name = get_tem_sheet_name()
+    color_hex = get_env("COLOR_HEX_MANDATORY", "#FFF9C4")
+    overwrite = get_bool_env("OVERWRITE_NONEMPTY", False)
+
+    try:
+        tem_ws = safe_worksheet(sh, tem_name)
+    except WorksheetNotFound:
+        print(f"[!] {tem_name} 탭 없음. Step1 선행 필요."); return
+
+    defaults_map, catprops_map = _prep_step_2(ref)
+
+    vals = with_retry(lambda: tem_ws.get_all_values()) or []
+    if not vals: print("[!] TEM_OUTPUT 비어 있음."); return
+
+    sheet_id = _tem_sheet_id(sh, tem_name)
+    if sheet_id is None: print("[!] 시트 ID 찾지 못함."); return
+
+    total_filled, color_ranges_by_col = _apply_step_2(vals, defaults_map, catprops_map, overwrite)
+
+    if total_filled:
+        _flush_matrix(tem_ws, vals)
+
+    requests = _step2_format_requests(sheet_id, color_ranges_by_col, color_hex)
     if requests:
         with_retry(lambda: sh.batch_update({"requests": requests}))
 
@@ -386,43 +641,36 @@ def run_step_2(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
 # STEP 3: FDA 코드 채우기
 # ==============================================================================
 
-def run_step_3(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet, overwrite: bool = False):
-    """
-    (개선) Step 3: Reference 시트의 목록을 기준으로, TEM_OUTPUT 행에 고정 FDA 코드를 채웁니다.
-    """
-    print("\n[ Automation ] Starting Step 3: Fill FDA Code...")
-    
-    tem_name = get_tem_sheet_name()
-    fda_sheet_name = get_env("FDA_CATEGORIES_SHEET_NAME", "TH Cos") # .env에서 시트 이름 읽기
-    fda_header = get_env("FDA_HEADER_NAME", "FDA Registration No.")
-    FDA_CODE = "10-1-9999999"  # 고정값으로 변경
+_FDA_CODE = "10-1-9999999"  # 고정값
 
+
+def _prep_step_3(ref: gspread.Spreadsheet):
+    """FDA 대상 카테고리 목록 로드. 실패 시 None (Step 3 스킵)"""
+    fda_sheet_name = get_env("FDA_CATEGORIES_SHEET_NAME", "TH Cos")  # .env에서 시트 이름 읽기
     try:
-        # Reference 시트에서 FDA 대상 카테고리 목록 읽기
+        # (개선) majorDimension=COLUMNS로 받아 1행짜리 리스트 언랩 없이 평면 리스트로 처리
         fda_ws = safe_worksheet(ref, fda_sheet_name)
-        fda_vals_2d = with_retry(lambda: fda_ws.get_values('A:A', value_render_option='UNFORMATTED_VALUE'))
-        fda_vals = [r[0] for r in (fda_vals_2d or []) if r and str(r[0]).strip()]
-        # (개선) 전체 경로를 소문자로 변환하여 비교
-        target_categories = {str(cat).strip().lower() for cat in fda_vals if str(cat).strip()}
+        resp = with_retry(lambda: fda_ws.spreadsheet.values_get(
+            f"{fda_ws.title}!A:A",
+            params={'majorDimension': 'COLUMNS', 'valueRenderOption': 'UNFORMATTED_VALUE'},
+        ))
+        fda_vals = (resp.get("values") or [[]])[0]
+        # (개선) 전체 경로를 소문자로 변환하여 비교. intern으로 셋 멤버십의 해시/비교를
+        # 포인터 동일성 단락으로 끝나게 한다 (TEM 쪽도 intern해서 조회)
+        return frozenset(sys.intern(str(cat).strip().lower()) for cat in fda_vals if str(cat).strip())
     except Exception as e:
-        print(f"[!] '{fda_sheet_name}' 탭을 읽는 데 실패했습니다: {e}. Step 3을 건너<binary data, 2 bytes><binary data, 2 bytes><binary data, 2 bytes>니다.")
-        return
-
-    try:
-        tem_ws = safe_worksheet(sh, tem_name)
-        vals = with_retry(lambda: tem_ws.get_all_values()) or []
-    except WorksheetNotFound:
-        print(f"[!] {tem_name} 탭 없음. Step1 선행 필요."); return
+        print(f"[!] '{fda_sheet_name}' 탭을 읽는 데 실패했습니다: {e}. Step 3을 건너뜁니다.")
+        return None
 
-    if not vals: print("[!] TEM_OUTPUT 비어 있음."); return
 
-    updates: List[Cell] = []
+def _apply_step_3(vals: List[List[str]], target_categories, fda_header: str, overwrite: bool) -> int:
+    """Step 3 본체: vals를 제자리 수정. 적용된 셀 수 반환"""
     current_keys, col_category_B, col_fda_B = None, -1, -1
     updated_rows = 0
 
     for r0, row in enumerate(vals):
         if (row[1] if len(row) > 1 else "").strip().lower() == "category":
-            current_keys = [header_key(h) for h in row[1:]]
+            current_keys = _header_keys(row[1:])
             col_category_B = _find_col_index(current_keys, "category")
             col_fda_B = _find_col_index(current_keys, fda_header)
             continue
@@ -430,138 +678,241 @@ def run_step_3(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet, overwrite: boo
 
         pid = (row[0] if len(row) > 0 else "").strip()
         if not pid: continue
-        
+
         # (개선) TEM_OUTPUT의 카테고리 값도 전체 경로를 소문자로 변환하여 비교
-        category_val_raw = (row[col_category_B + 1] if len(row) > (col_category_B + 1) else "").strip()
-        category_val_normalized = category_val_raw.lower()
-        
+        category_val_normalized = sys.intern((row[col_category_B + 1] if len(row) > (col_category_B + 1) else "").strip().lower())
+
         # (개선) 정규화된 전체 경로가 목록에 있는지 확인
         if category_val_normalized and category_val_normalized in target_categories:
             c_fda_sheet_col = col_fda_B + 2
             cur_fda = (row[c_fda_sheet_col - 1] if len(row) >= c_fda_sheet_col else "").strip()
-            
+
             if not cur_fda or overwrite:
-                updates.append(Cell(row=r0 + 1, col=c_fda_sheet_col, value=FDA_CODE))
+                _set_val(vals, r0, c_fda_sheet_col - 1, _FDA_CODE)
                 updated_rows += 1
 
-    if updates:
-        with_retry(lambda: tem_ws.update_cells(updates, value_input_option="RAW"))
-
-    print(f"========== STEP 3 FDA RESULT (WRITE) ==========")
-    print(f"적용된 셀 수: {updated_rows:,}")
-    print("Step 3: Fill FDA Code Finished.")
-
+    return updated_rows
 
-# ==============================================================================
-# STEP 4: 기타 필드 채우기
-# ==============================================================================
 
-def run_step_4(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
-    """Step 4: TEM_OUTPUT의 Stock / Days to ship / Weight / Brand 채우기"""
-    print("\n[ Automation ] Starting Step 4: Fill Other Fields...")
+def run_step_3(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet, overwrite: bool = False):
+    """
+    (개선) Step 3: Reference 시트의 목록을 기준으로, TEM_OUTPUT 행에 고정 FDA 코드를 채웁니다.
+    """
+    print("\n[ Automation ] Starting Step 3: Fill FDA Code...")
 
     tem_name = get_tem_sheet_name()
-    STOCK_VALUE = int(get_env("STEP4_STOCK_VALUE", "1000"))
-    DTOS_VALUE  = int(get_env("STEP4_DTOS_VALUE", "1"))
+    fda_header = get_env("FDA_HEADER_NAME", "FDA Registration No.")
 
-    # (개선) Step 3의 변경 사항이 반영된 최신 데이터를 다시 읽어옴
-    tem_ws = safe_worksheet(sh, tem_name)
-    tem_vals = with_retry(lambda: tem_ws.get_all_values()) or []
-    if not tem_vals: print("[!] TEM_OUTPUT 비어 있음."); return
+    target_categories = _prep_step_3(ref)
+    if target_categories is None:
+        return
 
     try:
-        margin_ws = safe_worksheet(sh, "MARGIN")
-        margin_vals = with_retry(lambda: margin_ws.get_all_values()) or []
-    except Exception: margin_vals = []
+        tem_ws = safe_worksheet(sh, tem_name)
+        vals = with_retry(lambda: tem_ws.get_all_values()) or []
+    except WorksheetNotFound:
+        print(f"[!] {tem_name} 탭 없음. Step1 선행 필요."); return
 
-    try:
-        brand_ws = safe_worksheet(ref, "Brand")
-        brand_vals = with_retry(lambda: brand_ws.get_all_values()) or []
-    except Exception:
-        brand_vals = []
+    if not vals: print("[!] TEM_OUTPUT 비어 있음."); return
 
-    sku_to_weight: Dict[str, str] = {}
-    sku_to_brand_name: Dict[str, str] = {}
-    if margin_vals:
-        mh = margin_vals[0]
-        idx_sku = _pick_index_by_candidates(mh, ["sku", "seller_sku"])
-        idx_brandn = _pick_index_by_candidates(mh, ["brand", "brand name"])
-        idx_wgt = _pick_index_by_candidates(mh, ["weight", "package weight"])
-        if idx_sku >= 0:
-            for r in range(1, len(margin_vals)):
-                row = margin_vals[r]
-                sku = (row[idx_sku] if idx_sku < len(row) else "").strip()
-                if not sku: continue
-                if 0 <= idx_wgt < len(row): sku_to_weight[sku] = (row[idx_wgt] or "").strip()
-                if 0 <= idx_brandn < len(row): sku_to_brand_name[sku] = (row[idx_brandn] or "").strip()
+    updated_rows = _apply_step_3(vals, target_categories, fda_header, overwrite)
 
-    brand_name_to_code: Dict[str, str] = {}
-    if brand_vals and len(brand_vals[0]) >= 3:
-        for r in range(1, len(brand_vals)):
-            row = brand_vals[r]
-            if len(row) < 3: continue
-            bname = (row[1] or "").strip()
-            bcode = (row[2] or "").strip()
-            if bname: brand_name_to_code[re.sub(r"\s+", " ", bname.lower())] = bcode
-    
+    if updated_rows:
+        _flush_matrix(tem_ws, vals)
+
+    print(f"========== STEP 3 FDA RESULT (WRITE) ==========")
+    print(f"적용된 셀 수: {updated_rows:,}")
+    print("Step 3: Fill FDA Code Finished.")
+
+
+# ==============================================================================
+# STEP 4: 기타 필드 채우기
+# ==============================================================================
+def _scan_rows_step4(
+    tem_vals: List[List[str]],
+    stock_str: str,
+    dtos_str: str,
+    sku_to_weight: Dict[str, str],
+    sku_to_brand_name: Dict[str, str],
+    brand_name_to_code: Dict[str, str],
+) -> Tuple[List[List[str]], Tuple[int, int, int, int]]:
+    """
+    Step 4의 행 스캔 루프. 헤더 인덱스를 블록 단위로 한 번만 계산하고,
+    루프 내에서 쓰는 이름들을 지역 변수로 끌어올려 인터프리터 오버헤드를 줄인다.
+    tem_vals를 제자리에서 수정하며, 기록은 호출자가 _flush_matrix로 일괄 수행.
+    """
     failures: List[List[str]] = []
-    cells_to_update: List[Cell] = []
     cnt_stock = cnt_dtos = cnt_weight = cnt_brand = 0
+    idx_stock_B = idx_dtos_B = idx_weight_B = idx_brand_B = idx_sku_B = -1
     current_headers = None
 
-    for r in range(len(tem_vals)):
-        row = tem_vals[r]
+    # 핫루프 바인딩 hoist
+    _set = _set_val
+    _find = _find_col_index
+    fail_append = failures.append
+    _get_w = sku_to_weight.get
+    # MARGIN/Brand 로드 실패 시 행마다 dict 미스를 내지 않도록 통째로 스킵하되,
+    # 조용히 넘어가지 않도록 집계 실패 1행으로 참조 읽기 문제를 알린다
+    have_weight = bool(sku_to_weight)
+    have_brand = bool(sku_to_brand_name)
+    if not have_weight:
+        fail_append(["", "", "", "WEIGHT_MAP_MISSING",
+                     "MARGIN weight 맵이 비어 있음(로드 실패 가능) — Weight 채움 전체 생략"])
+    if not have_brand:
+        fail_append(["", "", "", "BRAND_MAP_MISSING",
+                     "MARGIN brand 맵이 비어 있음(로드 실패 가능) — Brand 코드 채움 전체 생략"])
+
+    # sku→brand code를 미리 결합: 행 루프의 정규화 + 이중 dict 조회를 단일 조회로
+    sku_to_bcode: Dict[str, str] = {}
+    brand_missing: Dict[str, str] = {}  # 코드 미발견 sku → brand name (실패 기록용)
+    for _sku, _bname in sku_to_brand_name.items():
+        if not _bname: continue
+        _bcode = brand_name_to_code.get(_norm_opt(_bname))
+        if _bcode:
+            sku_to_bcode[_sku] = _bcode
+        else:
+            brand_missing[_sku] = _bname
+    _get_bcode = sku_to_bcode.get
+    _get_missing = brand_missing.get
+
+    for r, row in enumerate(tem_vals):
         if (row[1] if len(row) > 1 else "").strip().lower() == "category":
             current_headers = row[1:]
-            idx_stock_B  = _find_col_index([header_key(h) for h in current_headers], "stock")
-            idx_dtos_B   = _find_col_index([header_key(h) for h in current_headers], "daystoship")
-            idx_weight_B = _find_col_index([header_key(h) for h in current_headers], "weight")
-            idx_brand_B  = _find_col_index([header_key(h) for h in current_headers], "brand")
-            idx_sku_B    = _find_col_index([header_key(h) for h in current_headers], "sku")
+            keys = _header_keys(current_headers)
+            idx_stock_B  = _find(keys, "stock")
+            idx_dtos_B   = _find(keys, "daystoship")
+            idx_weight_B = _find(keys, "weight")
+            idx_brand_B  = _find(keys, "brand")
+            idx_sku_B    = _find(keys, "sku")
             continue
         if not current_headers: continue
-        
-        pid = (row[0] if len(row) > 0 else "").strip()
-        
+
+        n = len(row)
+        pid = (row[0] if n > 0 else "").strip()
+
         if idx_stock_B >= 0:
             c = idx_stock_B + 2
-            if (row[c - 1] if len(row) >= c else "") != str(STOCK_VALUE):
-                cells_to_update.append(Cell(row=r + 1, col=c, value=str(STOCK_VALUE)))
+            if (row[c - 1] if n >= c else "") != stock_str:
+                _set(tem_vals, r, c - 1, stock_str)
                 cnt_stock += 1
         if idx_dtos_B >= 0:
             c = idx_dtos_B + 2
-            if (row[c - 1] if len(row) >= c else "") != str(DTOS_VALUE):
-                cells_to_update.append(Cell(row=r + 1, col=c, value=str(DTOS_VALUE)))
+            if (row[c - 1] if n >= c else "") != dtos_str:
+                _set(tem_vals, r, c - 1, dtos_str)
                 cnt_dtos += 1
-        
+
         sku_val = ""
         if idx_sku_B >= 0:
             csku = idx_sku_B + 2
-            sku_val = (row[csku - 1] if len(row) >= csku else "").strip()
+            sku_val = (row[csku - 1] if n >= csku else "").strip()
 
-        if idx_weight_B >= 0 and sku_val:
-            w = sku_to_weight.get(sku_val)
+        if have_weight and idx_weight_B >= 0 and sku_val:
+            w = _get_w(sku_val)
             if w:
                 c = idx_weight_B + 2
-                if (row[c - 1] if len(row) >= c else "") != w:
-                    cells_to_update.append(Cell(row=r + 1, col=c, value=w))
+                if (row[c - 1] if n >= c else "") != w:
+                    _set(tem_vals, r, c - 1, w)
                     cnt_weight += 1
-            else: failures.append([pid, "", "", "WEIGHT_MAP_MISSING", f"sku={sku_val}"])
+            else: fail_append([pid, "", "", "WEIGHT_MAP_MISSING", f"sku={sku_val}"])
 
-        if idx_brand_B >= 0 and sku_val:
-            bname = sku_to_brand_name.get(sku_val)
-            bcode = brand_name_to_code.get(re.sub(r"\s+", " ", bname.lower())) if bname else None
-            new_bcode = bcode if bcode else "0"
+        if have_brand and idx_brand_B >= 0 and sku_val:
+            new_bcode = _get_bcode(sku_val, "0")
             c = idx_brand_B + 2
-            if (row[c - 1] if len(row) >= c else "") != new_bcode:
-                cells_to_update.append(Cell(row=r + 1, col=c, value=new_bcode))
+            if (row[c - 1] if n >= c else "") != new_bcode:
+                _set(tem_vals, r, c - 1, new_bcode)
                 cnt_brand += 1
-            if bname and not bcode:
-                failures.append([pid, "", "", "BRAND_CODE_NOT_FOUND", f"brand_name={bname}"])
-    
-    if cells_to_update:
-        with_retry(lambda: tem_ws.update_cells(cells_to_update, value_input_option="USER_ENTERED"))
-    
+            bname = _get_missing(sku_val)
+            if bname:
+                fail_append([pid, "", "", "BRAND_CODE_NOT_FOUND", f"brand_name={bname}"])
+
+    return failures, (cnt_stock, cnt_dtos, cnt_weight, cnt_brand)
+
+
+
+def _prep_step_4(
+    sh: gspread.Spreadsheet,
+    ref: gspread.Spreadsheet,
+    margin_header: Optional[List] = None,
+    brand_vals: Optional[List[List]] = None,
+):
+    """
+    Step 4 참조 맵 로드: (sku→weight, sku→brand name, brand name→code)
+    margin_header/brand_vals가 미리 batchGet된 값이면 해당 읽기를 생략한다.
+    """
+    # MARGIN은 2단계로 읽는다: 헤더 행으로 필요한 열 폭을 정한 뒤 그 범위만 가져온다
+    idx_sku = idx_brandn = idx_wgt = -1
+    margin_body: List[List] = []
+    try:
+        margin_ws = safe_worksheet(sh, "MARGIN")
+        if margin_header is None:
+            mh_rows = _values_unformatted(margin_ws, "1:1")
+            mh = mh_rows[0] if mh_rows else []
+        else:
+            mh = margin_header
+        idx_sku = _pick_index_by_candidates(mh, ["sku", "seller_sku"])
+        idx_brandn = _pick_index_by_candidates(mh, ["brand", "brand name"])
+        idx_wgt = _pick_index_by_candidates(mh, ["weight", "package weight"])
+        if idx_sku >= 0:
+            last_col = max(idx_sku, idx_brandn, idx_wgt) + 1
+            end_col = rowcol_to_a1(1, last_col).rstrip("0123456789")
+            margin_body = _values_unformatted(margin_ws, f"A2:{end_col}") or []
+    except Exception:
+        margin_body = []
+
+    if brand_vals is None:
+        try:
+            brand_ws = safe_worksheet(ref, "Brand")
+            brand_vals = _values_unformatted(brand_ws, "A:C") or []
+        except Exception:
+            brand_vals = []
+
+    sku_to_weight: Dict[str, str] = {}
+    sku_to_brand_name: Dict[str, str] = {}
+    if idx_sku >= 0:
+        for row in margin_body:
+            # UNFORMATTED_VALUE는 숫자 셀을 int/float로 주므로 str 코어션 후 정규화
+            sku = str(row[idx_sku] if idx_sku < len(row) else "").strip()
+            if not sku: continue
+            if 0 <= idx_wgt < len(row): sku_to_weight[sku] = str(row[idx_wgt] or "").strip()
+            if 0 <= idx_brandn < len(row): sku_to_brand_name[sku] = str(row[idx_brandn] or "").strip()
+
+    brand_name_to_code: Dict[str, str] = {}
+    # 헤더 행은 batchGet에서 끝이 잘릴 수 있으므로 폭 검사는 행별 가드에 맡긴다
+    # (헤더 C열이 비어 있어도 데이터 행에 코드가 있으면 맵을 만든다)
+    if brand_vals:
+        for r in range(1, len(brand_vals)):
+            row = brand_vals[r]
+            if len(row) < 3: continue
+            bname = str(row[1] or "").strip()
+            bcode = str(row[2] or "").strip()
+            if bname: brand_name_to_code[_norm_opt(bname)] = bcode
+
+    return sku_to_weight, sku_to_brand_name, brand_name_to_code
+
+
+def run_step_4(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
+    """Step 4: TEM_OUTPUT의 Stock / Days to ship / Weight / Brand 채우기"""
+    print("\n[ Automation ] Starting Step 4: Fill Other Fields...")
+
+    tem_name = get_tem_sheet_name()
+    STOCK_VALUE = int(get_env("STEP4_STOCK_VALUE", "1000"))
+    DTOS_VALUE  = int(get_env("STEP4_DTOS_VALUE", "1"))
+
+    # (개선) Step 3의 변경 사항이 반영된 최신 데이터를 다시 읽어옴
+    tem_ws = safe_worksheet(sh, tem_name)
+    tem_vals = with_retry(lambda: tem_ws.get_all_values()) or []
+    if not tem_vals: print("[!] TEM_OUTPUT 비어 있음."); return
+
+    sku_to_weight, sku_to_brand_name, brand_name_to_code = _prep_step_4(sh, ref)
+
+    failures, (cnt_stock, cnt_dtos, cnt_weight, cnt_brand) = _scan_rows_step4(
+        tem_vals, str(STOCK_VALUE), str(DTOS_VALUE),
+        sku_to_weight, sku_to_brand_name, brand_name_to_code,
+    )
+
+    if cnt_stock or cnt_dtos or cnt_weight or cnt_brand:
+        _flush_matrix(tem_ws, tem_vals)
+
     if failures:
         _append_failures(sh, failures)
 
@@ -573,66 +924,118 @@ def run_step_4(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet):
 # ==============================================================================
 # STEP 5: Description, Variation Integration, Global SKU Price
 # ==============================================================================
+
+def _prep_step_5(
+    sh: gspread.Spreadsheet,
+    basic_vals: Optional[List[List]] = None,
+    margin_vals: Optional[List[List]] = None,
+):
+    """
+    Step 5 데이터 맵: (pid→description, sku→price)
+    basic_vals/margin_vals가 미리 batchGet된 값이면 해당 읽기를 생략한다.
+    """
+    # 필요한 열만 좁혀 읽는다 (BASIC: pid~description, MARGIN: sku~price)
+    if basic_vals is None:
+        basic_ws = safe_worksheet(sh, "BASIC")
+        basic_vals = _values_unformatted(basic_ws, "A:D") or []
+
+    if margin_vals is None:
+        margin_ws = safe_worksheet(sh, "MARGIN")
+        margin_vals = _values_unformatted(margin_ws, "A:E") or []
+
+    # UNFORMATTED_VALUE → str 코어션
+    pid_to_desc = {str(row[0]).strip(): str(row[3] if len(row) > 3 else "") for row in basic_vals[1:] if row and str(row[0]).strip()}
+    sku_to_price = {str(row[0]).strip(): str(row[4] if len(row) > 4 else "") for row in margin_vals[1:] if row and str(row[0]).strip()}
+    return pid_to_desc, sku_to_price
+
+
+def _apply_step_5(tem_vals: List[List[str]], pid_to_desc, sku_to_price) -> int:
+    """Step 5 본체: vals를 제자리 수정. 수정 건수 반환"""
+    n_updates = 0
+    # Variation Integration을 본 루프에 융합: pid의 첫 행과 등장 횟수만 추적하고
+    # 두 번째 등장 시점에 첫 행을 소급 승격한다 (pid_groups 재순회 제거)
+    pid_first: Dict[str, int] = {}
+    pid_count: Dict[str, int] = {}
+
+    # 핫루프 바깥에서 조회 대상들을 지역 변수로 고정 (속성/전역 조회 비용 절감)
+    _set = _set_val
+    _get_desc = pid_to_desc.get
+    _get_price = sku_to_price.get
+    _get_count = pid_count.get
+
+    # 헤더 행 경계를 먼저 구해 블록 단위로 순회: 행마다 'category' 비교를 하지 않는다
+    hdr_rows = _header_rows(tem_vals)
+    n_rows = len(tem_vals)
+    for k, h in enumerate(hdr_rows):
+        block_end = hdr_rows[k + 1] if k + 1 < len(hdr_rows) else n_rows
+        keys = _header_keys(tem_vals[h][1:])
+        idx_desc = _find_col_index(keys, "productdescription")
+        idx_var_integ = _find_col_index(keys, "variationintegration")
+        idx_price = _find_col_index(keys, "globalskuprice")
+        idx_sku = _find_col_index(keys, "sku")
+
+        for r_idx in range(h + 1, block_end):
+            row = tem_vals[r_idx]
+            pid = (row[0] if len(row) > 0 else "").strip()
+            if not pid: continue
+
+            # 2. Variation Integration (같은 pid 2행째부터 V코드 기록, 첫 행은 소급)
+            if idx_var_integ != -1:
+                cnt = _get_count(pid, 0)
+                if cnt == 0:
+                    pid_first[pid] = r_idx
+                else:
+                    v_code = "V" + pid
+                    if cnt == 1:
+                        _set(tem_vals, pid_first[pid], idx_var_integ + 1, v_code)
+                        n_updates += 1
+                    _set(tem_vals, r_idx, idx_var_integ + 1, v_code)
+                    n_updates += 1
+                pid_count[pid] = cnt + 1
+
+            # 1. Description (이미 같은 값이면 재작성 생략)
+            if idx_desc != -1:
+                desc = _get_desc(pid, "")
+                cur_desc = (row[idx_desc + 1] if len(row) > idx_desc + 1 else "")
+                if cur_desc != desc:
+                    _set(tem_vals, r_idx, idx_desc + 1, desc)
+                    n_updates += 1
+
+            # 3. Global SKU Price (이미 같은 값이면 재작성 생략)
+            if idx_price != -1 and idx_sku != -1:
+                sku_val = (row[idx_sku + 1] if len(row) > idx_sku + 1 else "").strip()
+                if sku_val:
+                    price = _get_price(sku_val, "")
+                    cur_price = (row[idx_price + 1] if len(row) > idx_price + 1 else "")
+                    if cur_price != price:
+                        _set(tem_vals, r_idx, idx_price + 1, price)
+                        n_updates += 1
+
+    return n_updates
+
+
 def run_step_5(sh: gspread.Spreadsheet):
     """Step 5: Description, Variation Integration, Global SKU Price 채우기"""
     print("\n[ Automation ] Starting Step 5: Fill essential info...")
 
     tem_name = get_tem_sheet_name()
-    # (개선) Step 4의 변경 사항이 반영된 최신 데이터를 다시 읽어옴
+    # (개선) Step 4의 변경 사항이 반영된 최신 데이터를 다시 읽어옴.
+    # TEM/BASIC/MARGIN을 batchGet 1회로 묶어 왕복 3회 → 1회.
+    # (렌더 옵션은 기본 FORMATTED — 기존 get_all_values와 동일한 문자열 값)
     tem_ws = safe_worksheet(sh, tem_name)
-    tem_vals = with_retry(lambda: tem_ws.get_all_values()) or []
+    resp = with_retry(lambda: sh.values_batch_get(
+        ranges=[f"{tem_name}!A:ZZ", "BASIC!A:D", "MARGIN!A:E"]))
+    vr = resp.get("valueRanges", [])
+    tem_vals = vr[0].get("values", []) if len(vr) > 0 else []
+    basic_vals = vr[1].get("values", []) if len(vr) > 1 else []
+    margin_vals = vr[2].get("values", []) if len(vr) > 2 else []
 
-    basic_ws = safe_worksheet(sh, "BASIC")
-    basic_vals = with_retry(lambda: basic_ws.get_all_values()) or []
-    
-    margin_ws = safe_worksheet(sh, "MARGIN")
-    margin_vals = with_retry(lambda: margin_ws.get_all_values()) or []
+    pid_to_desc, sku_to_price = _prep_step_5(sh, basic_vals=basic_vals, margin_vals=margin_vals)
 
-    # --- 데이터 맵 준비 ---
-    pid_to_desc = {row[0].strip(): (row[3] if len(row) > 3 else "") for row in basic_vals[1:] if row and row[0].strip()}
-    sku_to_price = {row[0].strip(): (row[4] if len(row) > 4 else "") for row in margin_vals[1:] if row and row[0].strip()}
-    
-    updates: List[Cell] = []
-    current_headers = None
-    pid_groups = defaultdict(list)
-    
-    for r_idx, row in enumerate(tem_vals):
-        if (row[1] if len(row) > 1 else "").strip().lower() == "category":
-            current_headers = [header_key(h) for h in row[1:]]
-            idx_desc = _find_col_index(current_headers, "productdescription")
-            idx_var_integ = _find_col_index(current_headers, "variationintegration")
-            idx_price = _find_col_index(current_headers, "globalskuprice")
-            idx_sku = _find_col_index(current_headers, "sku")
-            continue
-        if not current_headers: continue
-        
-        pid = (row[0] if len(row) > 0 else "").strip()
-        if not pid: continue
-        
-        pid_groups[pid].append(r_idx + 1)
-        
-        # 1. Description
-        if idx_desc != -1:
-            desc = pid_to_desc.get(pid, "")
-            updates.append(Cell(row=r_idx + 1, col=idx_desc + 2, value=desc))
-
-        # 3. Global SKU Price
-        if idx_price != -1 and idx_sku != -1:
-            sku_val = (row[idx_sku + 1] if len(row) > idx_sku + 1 else "").strip()
-            if sku_val:
-                price = sku_to_price.get(sku_val, "")
-                updates.append(Cell(row=r_idx + 1, col=idx_price + 2, value=price))
-
-    # 2. Variation Integration
-    if idx_var_integ != -1:
-        for pid, rows in pid_groups.items():
-            if len(rows) > 1: # Only for variations
-                v_code = f"V{pid}"
-                for r in rows:
-                    updates.append(Cell(row=r, col=idx_var_integ + 2, value=v_code))
-
-    if updates:
-        with_retry(lambda: tem_ws.update_cells(updates, value_input_option="USER_ENTERED"))
+    n_updates = _apply_step_5(tem_vals, pid_to_desc, sku_to_price)
+
+    if n_updates:
+        _flush_matrix(tem_ws, tem_vals)
 
     print("Step 5: Fill essential info Finished.")
 
@@ -640,92 +1043,233 @@ def run_step_5(sh: gspread.Spreadsheet):
 # ==============================================================================
 # STEP 6: Cover Image URL 생성
 # ==============================================================================
+
+def _apply_step_6(tem_vals: List[List[str]], shop_code: str, host: str) -> int:
+    """Step 6 본체: vals를 제자리 수정. 수정 건수 반환"""
+    n_updates = 0
+    # shop_code/host는 호출 내내 상수 → 행마다 f-string 포맷 대신 상수 접두/접미 연결.
+    # 같은 parent SKU가 여러 행에 반복되므로 sku→url 캐시로 연결 자체도 대부분 생략.
+    suffix = f"_C_{shop_code}.jpg"
+    url_cache: Dict[str, str] = {}
+
+    # 블록 단위 순회 (행마다 'category' 비교 제거)
+    hdr_rows = _header_rows(tem_vals)
+    n_rows = len(tem_vals)
+    for k, h in enumerate(hdr_rows):
+        block_end = hdr_rows[k + 1] if k + 1 < len(hdr_rows) else n_rows
+        keys = _header_keys(tem_vals[h][1:])
+        idx_cover = _find_col_index(keys, "coverimage")
+        idx_sku = _find_col_index(keys, "sku")
+        idx_psku = _find_col_index(keys, "parentsku")
+        if idx_cover == -1: continue
+
+        for r_idx in range(h + 1, block_end):
+            row = tem_vals[r_idx]
+
+            # (개선) Parent SKU와 SKU 값을 모두 가져옵니다.
+            psku_val = (row[idx_psku + 1] if idx_psku != -1 and len(row) > idx_psku + 1 else "").strip()
+            sku_val = (row[idx_sku + 1] if idx_sku != -1 and len(row) > idx_sku + 1 else "").strip()
+
+            # (개선) URL 생성에 사용할 SKU를 결정합니다 (Parent SKU 우선).
+            sku_for_url = psku_val if psku_val else sku_val
+
+            # 사용할 SKU가 있는 경우에만 URL을 생성합니다.
+            if sku_for_url:
+                url = url_cache.get(sku_for_url)
+                if url is None:
+                    url = url_cache[sku_for_url] = host + sku_for_url + suffix
+                # (개선) 이미 같은 URL이면 재작성 생략 → 재실행 시 페이로드/쿼터 절약
+                cur_cover = (row[idx_cover + 1] if len(row) > idx_cover + 1 else "").strip()
+                if cur_cover == url:
+                    continue
+                _set_val(tem_vals, r_idx, idx_cover + 1, url)
+                n_updates += 1
+
+    return n_updates
+
+
 def run_step_6(sh: gspread.Spreadsheet, shop_code: str):
     """
     (개선) Step 6: Parent SKU 우선 규칙을 적용하여 Cover image URL을 동적으로 생성합니다.
     """
     print("\n[ Automation ] Starting Step 6: Generate Cover Image URLs...")
-    
+
     tem_name = get_tem_sheet_name()
     # (개선) Step 5의 변경 사항이 반영된 최신 데이터를 다시 읽어옴
     tem_ws = safe_worksheet(sh, tem_name)
     tem_vals = with_retry(lambda: tem_ws.get_all_values()) or []
-    
+
     host = get_env("IMAGE_HOSTING_URL", "")
     if not host.endswith("/"): host += "/"
 
-    updates: List[Cell] = []
-    current_headers = None
+    n_updates = _apply_step_6(tem_vals, shop_code, host)
 
-    for r_idx, row in enumerate(tem_vals):
-        if (row[1] if len(row) > 1 else "").strip().lower() == "category":
-            current_headers = [header_key(h) for h in row[1:]]
-            idx_cover = _find_col_index(current_headers, "coverimage")
-            idx_sku = _find_col_index(current_headers, "sku")
-            idx_psku = _find_col_index(current_headers, "parentsku")
-            continue
-        if not current_headers or idx_cover == -1: continue
+    if n_updates:
+        _flush_matrix(tem_ws, tem_vals)
 
-        # (개선) Parent SKU와 SKU 값을 모두 가져옵니다.
-        psku_val = (row[idx_psku + 1] if idx_psku != -1 and len(row) > idx_psku + 1 else "").strip()
-        sku_val = (row[idx_sku + 1] if idx_sku != -1 and len(row) > idx_sku + 1 else "").strip()
+    print("Step 6: Generate Cover Image URLs Finished.")
 
-        # (개선) URL 생성에 사용할 SKU를 결정합니다 (Parent SKU 우선).
-        sku_for_url = psku_val if psku_val else sku_val
 
-        # 사용할 SKU가 있는 경우에만 URL을 생성합니다.
-        if sku_for_url:
-            url = f"{host}{sku_for_url}_C_{shop_code}.jpg"
-            updates.append(Cell(row=r_idx + 1, col=idx_cover + 2, value=url))
-    
-    if updates:
-        with_retry(lambda: tem_ws.update_cells(updates, value_input_option="USER_ENTERED"))
+# ==============================================================================
+# STEP 2~6 통합 파이프라인: TEM 1회 읽기 → 메모리 변환 → 1회 쓰기
+# ==============================================================================
 
-    print("Step 6: Generate Cover Image URLs Finished.")
+def run_steps_2_to_6(sh: gspread.Spreadsheet, ref: gspread.Spreadsheet, shop_code: str):
+    """
+    Step 2~6을 하나의 읽기/변환/쓰기 파이프라인으로 융합 실행.
+    개별 run_step_N은 TEM_OUTPUT을 각각 읽고 쓰므로(5회 읽기+5회 쓰기),
+    전체 실행 시에는 이 함수를 쓰면 같은 변환을 1회 읽기+1회 쓰기로 수행한다.
+    """
+    print("\n[ Automation ] Starting fused Steps 2-6 over TEM_OUTPUT...")
+
+    tem_name = get_tem_sheet_name()
+    color_hex = get_env("COLOR_HEX_MANDATORY", "#FFF9C4")
+    overwrite_defaults = get_bool_env("OVERWRITE_NONEMPTY", False)
+    fda_header = get_env("FDA_HEADER_NAME", "FDA Registration No.")
+    STOCK_VALUE = int(get_env("STEP4_STOCK_VALUE", "1000"))
+    DTOS_VALUE = int(get_env("STEP4_DTOS_VALUE", "1"))
+    host = get_env("IMAGE_HOSTING_URL", "")
+    if not host.endswith("/"): host += "/"
+
+    try:
+        tem_ws = safe_worksheet(sh, tem_name)
+    except WorksheetNotFound:
+        print(f"[!] {tem_name} 탭 없음. Step1 선행 필요."); return
+
+    tem_vals = with_retry(lambda: tem_ws.get_all_values()) or []
+    if not tem_vals: print("[!] TEM_OUTPUT 비어 있음."); return
+
+    sheet_id = _tem_sheet_id(sh, tem_name)
+
+    # --- 참조 데이터 로드 ---
+    # 같은 스프레드시트로 가는 읽기는 batchGet 1회로 묶는다 (탭별 왕복 제거)
+    defaults_map, catprops_map = _prep_step_2(ref)
+
+    fda_sheet = get_env("FDA_CATEGORIES_SHEET_NAME", "TH Cos")
+    target_categories = None
+    brand_vals: Optional[List[List]] = None
+    try:
+        resp = with_retry(lambda: ref.values_batch_get(
+            ranges=[f"{fda_sheet}!A:A", "Brand!A:C"],
+            params={"valueRenderOption": "UNFORMATTED_VALUE"},
+        ))
+        vr = resp.get("valueRanges", [])
+        fda_rows = vr[0].get("values", []) if len(vr) > 0 else []
+        brand_vals = vr[1].get("values", []) if len(vr) > 1 else []
+        target_categories = frozenset(
+            sys.intern(str(r[0]).strip().lower()) for r in fda_rows if r and str(r[0]).strip()
+        )
+    except Exception as e:
+        print(f"[!] 참조 시트 batchGet 실패: {e} → 탭별 읽기로 폴백")
+        target_categories = _prep_step_3(ref)
+
+    basic_vals = margin_vals = margin_header = None
+    try:
+        resp = with_retry(lambda: sh.values_batch_get(
+            ranges=["BASIC!A:D", "MARGIN!A:E", "MARGIN!1:1"],
+            params={"valueRenderOption": "UNFORMATTED_VALUE"},
+        ))
+        vr = resp.get("valueRanges", [])
+        basic_vals = vr[0].get("values", []) if len(vr) > 0 else []
+        margin_vals = vr[1].get("values", []) if len(vr) > 1 else []
+        margin_header = (vr[2].get("values") or [[]])[0] if len(vr) > 2 else []
+    except Exception as e:
+        print(f"[!] BASIC/MARGIN batchGet 실패: {e} → 탭별 읽기로 폴백")
+
+    sku_to_weight, sku_to_brand_name, brand_name_to_code = _prep_step_4(
+        sh, ref, margin_header=margin_header, brand_vals=brand_vals)
+    pid_to_desc, sku_to_price = _prep_step_5(sh, basic_vals=basic_vals, margin_vals=margin_vals)
+
+    # --- 메모리 변환 (Step 2 → 3 → 4 → 5 → 6 순서 유지) ---
+    n2, color_ranges_by_col = _apply_step_2(tem_vals, defaults_map, catprops_map, overwrite_defaults)
+    n3 = _apply_step_3(tem_vals, target_categories, fda_header, overwrite=True) if target_categories is not None else 0
+    failures, counts4 = _scan_rows_step4(
+        tem_vals, str(STOCK_VALUE), str(DTOS_VALUE),
+        sku_to_weight, sku_to_brand_name, brand_name_to_code,
+    )
+    n5 = _apply_step_5(tem_vals, pid_to_desc, sku_to_price)
+    n6 = _apply_step_6(tem_vals, shop_code, host)
+
+    # --- 단일 쓰기 + 포맷/실패 기록 ---
+    if n2 or n3 or any(counts4) or n5 or n6:
+        _flush_matrix(tem_ws, tem_vals)
+
+    if sheet_id is not None:
+        requests = _step2_format_requests(sheet_id, color_ranges_by_col, color_hex)
+        if requests:
+            with_retry(lambda: sh.batch_update({"requests": requests}))
+
+    if failures:
+        _append_failures(sh, failures)
+
+    print("========== STEPS 2-6 RESULT ==========")
+    print(f"기본값/FDA/기타/필수/커버 수정: {n2}/{n3}/{sum(counts4)}/{n5}/{n6}")
+    print("Fused Steps 2-6 Finished.")
 
 
 # ==============================================================================
 # STEP 7: 최종 템플릿 분할 & 다운로드
 # ==============================================================================
+
+# SKU 대시 정규화 ('A - B' → 'A-B'): 호출마다 재컴파일하지 않도록 모듈 스코프에 컴파일
+_DASH_RE = re.compile(r"\s*-\s*")
+# 엑셀 시트명에 쓸 수 없는 문자 제거용
+_SHEETNAME_RE = re.compile(r"[\s/\\*?:\[\]]")
+
+
 def run_step_7(sh: gspread.Spreadsheet):
     """Step 7: TEM_OUTPUT을 TopLevel Category 단위로 분할하여 엑셀 파일 생성"""
     print("\n[ Automation ] Starting Step 7: Generating final template file...")
     tem_name = get_tem_sheet_name()
     tem_ws = safe_worksheet(sh, tem_name)
-    
-    all_data = with_retry(lambda: tem_ws.get_values())
+
+    # UNFORMATTED_VALUE로 받아 로캘 포맷 렌더링/전송량을 줄인다.
+    # 숫자 셀은 int/float로 내려와 엑셀에도 숫자로 기록된다 (str 비교 지점은 코어션)
+    all_data = _values_unformatted(tem_ws)
 
     if not all_data:
         print("[!] TEM_OUTPUT sheet is empty. Cannot generate file.")
         return None
 
-    df = pd.DataFrame(all_data)
-    
-    header_indices = df[df[1].str.lower() == 'category'].index
-    
-    if header_indices.empty:
+    # 헤더 행 탐지/분할을 원본 리스트에서 직접 수행:
+    # 전체 DataFrame 생성 → iloc 슬라이스 → 슬라이스 대입 경로의 복사본들을 없앤다
+    header_rows = [
+        i for i, row in enumerate(all_data)
+        if len(row) > 1 and str(row[1]).strip().lower() == "category"
+    ]
+
+    if not header_rows:
         print("[!] No valid header rows found in TEM_OUTPUT.")
         return None
-        
+
     output = BytesIO()
     # 엑셀 생성 엔진을 xlsxwriter로 지정하여 성능 확보
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        for i, header_index in enumerate(header_indices):
-            start_row = header_index + 1
-            end_row = header_indices[i+1] if i + 1 < len(header_indices) else len(df)
-            
-            chunk_df = df.iloc[start_row:end_row]
-            if chunk_df.empty: continue
-            
-            first_cat = chunk_df.iloc[0, 1] if len(chunk_df.iloc[0]) > 1 else "UNKNOWN"
+    # strings_to_urls=False: 이미지 URL 셀마다 도는 하이퍼링크 변환 스캔 생략
+    # 주의: constant_memory는 금지 — pandas to_excel은 셀을 열(column) 단위로 쓰는데
+    # constant_memory 모드는 이미 flush된 행에 대한 쓰기를 조용히 버려 데이터가 깨진다
+    with pd.ExcelWriter(
+        output,
+        engine='xlsxwriter',
+        engine_kwargs={"options": {"strings_to_urls": False, "strings_to_formulas": False}},
+    ) as writer:
+        for i, h in enumerate(header_rows):
+            end = header_rows[i + 1] if i + 1 < len(header_rows) else len(all_data)
+            rows = all_data[h + 1:end]
+            if not rows: continue
+
+            first_cat = rows[0][1] if len(rows[0]) > 1 else "UNKNOWN"
             top_level_name = top_of_category(first_cat) or "UNKNOWN"
-            sheet_name = re.sub(r'[\s/\\*?:\[\]]', '_', top_level_name.title())[:31]
-
-            chunk_df = chunk_df.iloc[:, 1:]
+            sheet_name = _SHEETNAME_RE.sub('_', top_level_name.title())[:31]
 
-            chunk_df.iloc[:, 0] = chunk_df.iloc[:, 0].str.replace(r'\s*-\s*', '-', regex=True)
+            # pid 열 제거 + 첫 열(대시 정규화)을 리스트 수준에서 한 번에 처리
+            section = []
+            for row in rows:
+                r = row[1:]
+                if r and isinstance(r[0], str):
+                    r[0] = _DASH_RE.sub('-', r[0])
+                section.append(r)
 
-            chunk_df.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
+            pd.DataFrame(section).to_excel(writer, sheet_name=sheet_name, index=False, header=False)
 
     output.seek(0)
     print("Step 7: Final template file generated successfully.")
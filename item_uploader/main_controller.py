@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 import streamlit as st
-from gspread.exceptions import WorksheetNotFound
-from .utils_common import load_env, open_sheet_by_env, open_ref_by_env, safe_worksheet, with_retry
+from gspread.exceptions import WorksheetNotFound, APIError
+from .utils_common import load_env, open_sheet_by_env, open_ref_by_env, safe_worksheet, with_retry, evict_worksheet_cache
 
 # 통합된 automation_steps 하나만 import 합니다.
 from . import automation_steps
@@ -41,6 +41,14 @@ class ShopeeAutomation:
             with_retry(lambda: failures_ws.clear())
         except WorksheetNotFound:
             failures_ws = with_retry(lambda: self.sh.add_worksheet(title="Failures", rows=1000, cols=10))
+        except APIError:
+            # 캐시된 핸들이 가리키던 탭이 밖에서 삭제된 경우 → 캐시 비우고 1회 재조회
+            evict_worksheet_cache(self.sh, "Failures")
+            try:
+                failures_ws = safe_worksheet(self.sh, "Failures")
+                with_retry(lambda: failures_ws.clear())
+            except WorksheetNotFound:
+                failures_ws = with_retry(lambda: self.sh.add_worksheet(title="Failures", rows=1000, cols=10))
         
         # 헤더 다시 작성
         header = [["PID","Category","Name","Reason","Detail"]]
@@ -63,13 +71,12 @@ class ShopeeAutomation:
             return False, ["❌ Failures 시트 초기화 : **실패**"]
 
         # 2. 실행할 단계 목록 정의
+        # Step 2~6은 융합 파이프라인으로 실행: TEM_OUTPUT을 단계마다 다시 읽고 쓰는 대신
+        # 1회 읽기 → 메모리 변환 → 1회 쓰기 (run_steps_2_to_6 참고)
         steps = [
             ("Step 1: TEM_OUTPUT 시트 생성", self.run_step1_build_template),
-            ("Step 2: Mandatory 기본값 채우기", self.run_step2_fill_defaults),
-            ("Step 3: FDA 코드 채우기", self.run_step3_fill_fda),
-            ("Step 4: 기타 필드(재고, 브랜드 등) 채우기", self.run_step4_fill_etc),
-            ("Step 5: 필수 정보(설명, 가격 등) 채우기", self.run_step5_fill_info),
-            ("Step 6: 커버 이미지 URL 생성", lambda: self.run_step6_fill_images(shop_code)),
+            ("Step 2~6: 기본값/FDA/기타/필수 정보/커버 URL 채우기",
+             lambda: self.run_steps2_to_6(shop_code)),
         ]
 
         total_steps = len(steps)
@@ -91,6 +98,12 @@ class ShopeeAutomation:
                 all_success = False
                 break 
 
+        # 3. 스텝들이 버퍼에 모아둔 실패 행을 한 번에 Failures 탭으로 기록
+        try:
+            automation_steps.flush_failures(self.sh)
+        except Exception as e:
+            print(f"[ WARN ] Failures 기록 실패: {e}")
+
         progress_bar.empty()
         return all_success, results
 
@@ -106,6 +119,10 @@ class ShopeeAutomation:
             # 발생한 오류를 다시 상위로 보내 UI에 표시되도록 합니다.
             raise e
 
+    def run_steps2_to_6(self, shop_code: str):
+        """Step 2~6을 TEM 1회 읽기/1회 쓰기 파이프라인으로 실행합니다."""
+        automation_steps.run_steps_2_to_6(self.sh, self.ref, shop_code)
+
     def run_step2_fill_defaults(self):
         automation_steps.run_step_2(self.sh, self.ref)
 
@@ -1,17 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import hashlib
 import os
 import re
 from io import BytesIO
 from typing import List, Optional
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import ZipFile, ZIP_STORED
 
 import gspread
 from gspread.utils import rowcol_to_a1
+import numpy as np
 import pandas as pd
 from openpyxl import load_workbook
 
+# 선택 의존성: Rust 기반 XLSX 파서 (있으면 openpyxl보다 수 배 빠른 기본 경로)
+try:
+    from python_calamine import CalamineWorkbook
+except Exception:
+    CalamineWorkbook = None
+
 # 프로젝트 공통 유틸
 from .utils_common import open_sheet_by_env, safe_worksheet, with_retry
 
@@ -19,34 +27,51 @@ from .utils_common import open_sheet_by_env, safe_worksheet, with_retry
 # XLSX 파싱 안정화 (Shopee/엑셀 시트뷰 불일치 + 숨김행/메타 안전 처리)
 # ======================================================
 
+# <sheetViews>/<pane> 제거용 — 모듈 로드 시 1회 컴파일.
+# XLSX 내부 XML은 UTF-8이므로 바이트 패턴으로 직접 치환하여
+# 워크시트당 decode/encode 왕복(수 MB 문자열 복사 2회)을 없앤다.
+_SHEETVIEWS_RE = re.compile(rb'<(?:\w+:)?sheetViews\b[^>]*>.*?</(?:\w+:)?sheetViews>', re.DOTALL | re.IGNORECASE)
+_PANE_RE = re.compile(rb'<(?:\w+:)?pane\b[^>]*/\s*>', re.DOTALL | re.IGNORECASE)
+
+
 def _sanitize_xlsx_for_openpyxl(file_bytes: bytes) -> BytesIO:
     """
     - 일부 XLSX에서 openpyxl이 sheetViews/pane의 enum 검증에서 실패하는 문제를 예방.
     - 모든 worksheet XML의 <sheetViews ...> 블록 및 <pane/> 단독 태그를 제거.
     - 네임스페이스 접두사와 속성이 붙은 경우까지 전부 제거하도록 정규식 강화.
+    - 문제 태그가 아예 없는 워크북(일반적인 경우)은 rezip 없이 원본 그대로 반환.
     """
+    try:
+        with ZipFile(BytesIO(file_bytes), 'r') as zin:
+            # openpyxl이 실제로 걸려 넘어지는 트리거는 <pane> 요소다.
+            # sheetViews는 모든 워크시트에 있으므로 프로브하면 항상 rewrite로
+            # 빠진다 — pane 없는 일반 파일은 여기서 원본 그대로 통과시킨다.
+            needs_fix = any(
+                b'<pane' in buf
+                for buf in (
+                    zin.read(n) for n in zin.namelist()
+                    if n.startswith('xl/worksheets/') and n.endswith('.xml')
+                )
+            )
+        if not needs_fix:
+            return BytesIO(file_bytes)
+    except Exception:
+        return BytesIO(file_bytes)
+
     sanitized_buffer = BytesIO()
     try:
-        with ZipFile(BytesIO(file_bytes), 'r') as zin, ZipFile(sanitized_buffer, 'w', ZIP_DEFLATED) as zout:
+        # 결과물은 곧바로 openpyxl이 다시 해제하는 인메모리 버퍼라 재압축이 무의미 —
+        # 전 멤버 ZIP_STORED로 기록해 DEFLATE 인코딩 비용을 통째로 생략한다.
+        with ZipFile(BytesIO(file_bytes), 'r') as zin, ZipFile(sanitized_buffer, 'w', ZIP_STORED) as zout:
             for item in zin.infolist():
                 buffer = zin.read(item.filename)
-                if item.filename.startswith('xl/worksheets/') and item.filename.endswith('.xml'):
-                    xml_content = buffer.decode('utf-8', errors='ignore')
+                if (item.filename.startswith('xl/worksheets/') and item.filename.endswith('.xml')
+                        and (b'sheetViews' in buffer or b'pane' in buffer)):
                     # 1) <sheetViews ...> ... </sheetViews> 제거
-                    cleaned_xml = re.sub(
-                        r'<(?:\w+:)?sheetViews\b[^>]*>.*?</(?:\w+:)?sheetViews>',
-                        '',
-                        xml_content,
-                        flags=re.DOTALL | re.IGNORECASE,
-                    )
+                    buffer = _SHEETVIEWS_RE.sub(b'', buffer)
                     # 2) <pane .../> 단독 태그 제거
-                    cleaned_xml = re.sub(
-                        r'<(?:\w+:)?pane\b[^>]*/\s*>',
-                        '',
-                        cleaned_xml,
-                        flags=re.DOTALL | re.IGNORECASE,
-                    )
-                    buffer = cleaned_xml.encode('utf-8')
+                    buffer = _PANE_RE.sub(b'', buffer)
+                item.compress_type = ZIP_STORED
                 zout.writestr(item, buffer)
         sanitized_buffer.seek(0)
         return sanitized_buffer
@@ -61,12 +86,43 @@ def _count_nonempty_cells(ws, max_rows: int = 800, max_cols: int = 256) -> int:
     """시트 앞쪽 일부에서 non-empty 셀 수를 세어 데이터가 가장 많은 시트를 고른다."""
     rows = min(ws.max_row or 0, max_rows)
     cols = min(ws.max_column or 0, max_cols)
-    cnt = 0
-    for r in ws.iter_rows(min_row=1, max_row=rows, min_col=1, max_col=cols, values_only=True):
-        for c in r:
-            if c not in (None, '', ' '):
-                cnt += 1
-    return cnt
+    if rows == 0 or cols == 0:
+        return 0
+    # 셀 단위 파이썬 루프 대신 slab을 통째로 올려 C 수준에서 집계
+    slab = list(ws.iter_rows(min_row=1, max_row=rows, min_col=1, max_col=cols, values_only=True))
+    arr = np.array(slab, dtype=object)
+    return int(np.count_nonzero((arr != None) & (arr != '') & (arr != ' ')))  # noqa: E711
+
+
+def _read_with_calamine(sanitized_bio: BytesIO, logs: List[str], debug: bool = False) -> List[List[str]]:
+    """python-calamine이 설치돼 있을 때의 기본 경로. 모든 시트를 점수화해 최다 데이터 시트 선택."""
+    data: List[List[str]] = []
+    try:
+        sanitized_bio.seek(0)
+        wb = CalamineWorkbook.from_filelike(sanitized_bio)
+        best_rows = None; best_score = -1; best_name = None
+        if len(wb.sheet_names) == 1:
+            # 시트가 하나뿐이면 점수화(전체 셀 순회) 생략
+            best_name = wb.sheet_names[0]
+            best_rows = wb.get_sheet_by_name(best_name).to_python(skip_empty_area=True)
+            best_score = len(best_rows)
+        else:
+            for name in wb.sheet_names:
+                rows = wb.get_sheet_by_name(name).to_python(skip_empty_area=True)
+                score = sum(1 for r in rows for c in r if str(c).strip())
+                if score > best_score:
+                    best_score, best_rows, best_name = score, rows, name
+
+        if best_rows:
+            if debug:
+                logs.append(f"[DEBUG] calamine target sheet = {best_name}, score={best_score}")
+            data = [["" if c is None else str(c) for c in r] for r in best_rows]
+            data = [r for r in data if any(v.strip() for v in r)]
+    except Exception as e:
+        if debug:
+            logs.append(f"[DEBUG] calamine read failed → {e}")
+        data = []
+    return data
 
 
 def _read_with_openpyxl(sanitized_bio: BytesIO, logs: List[str], debug: bool = False) -> List[List[str]]:
@@ -77,20 +133,42 @@ def _read_with_openpyxl(sanitized_bio: BytesIO, logs: List[str], debug: bool = F
     data: List[List[str]] = []
     try:
         sanitized_bio.seek(0)
-        wb = load_workbook(sanitized_bio, data_only=True, read_only=True)
-        scored = [(_count_nonempty_cells(s), s) for s in wb.worksheets]
-        scored.sort(reverse=True, key=lambda x: x[0])
+        # keep_links=False: 외부 링크 파트 파싱 생략 (값만 필요).
+        # rich_text는 3.1부터 기본 False라 별도 지정 불필요.
+        wb = load_workbook(sanitized_bio, data_only=True, read_only=True, keep_links=False)
+        if len(wb.worksheets) == 1:
+            # 시트가 하나뿐이면 점수화 패스(추가 iter_rows 1회) 생략
+            ws = wb.worksheets[0]
+        else:
+            scored = [(_count_nonempty_cells(s), s) for s in wb.worksheets]
+            scored.sort(reverse=True, key=lambda x: x[0])
 
-        if debug:
-            logs.append("[DEBUG] openpyxl scores: " + ", ".join([f"{s.title}:{sc}" for sc, s in scored[:5]]))
+            if debug:
+                logs.append("[DEBUG] openpyxl scores: " + ", ".join([f"{s.title}:{sc}" for sc, s in scored[:5]]))
 
-        ws = (scored[0][1] if scored else wb.worksheets[0])
+            ws = (scored[0][1] if scored else wb.worksheets[0])
         if debug:
             logs.append(f"[DEBUG] openpyxl target sheet = {ws.title}")
 
-        for row in ws.iter_rows(values_only=True):
-            str_row = [str(cell) if cell is not None else "" for cell in row]
-            data.append(str_row)
+        # 셀 대부분은 이미 str — None/비문자열만 변환하고 str-str 재변환을 피한다
+        def _to_s(v):
+            if v is None:
+                return ""
+            return v if type(v) is str else str(v)
+
+        _append = data.append
+
+        # 과대 선언된 dimension("XFD" 등) 방어: 열은 ZZ(702)까지만 읽는다 —
+        # 시트 읽기 전반에서 쓰는 A:ZZ 관례와 동일한 상한
+        max_c = min(ws.max_column or 702, 702)
+
+        # 빈 행은 append 자체를 생략 (최종 필터와 같은 결과, 변환 비용만 절약).
+        # 빈 구간에서 조기 break 금지 — 중간에 50행 이상 비어도 그 뒤의 데이터를
+        # 버리면 안 되므로, 부풀려진 빈 꼬리도 끝까지 훑되 건너뛰기만 한다.
+        for row in ws.iter_rows(min_col=1, max_col=max_c, values_only=True):
+            if all(cell is None for cell in row):
+                continue
+            _append(list(map(_to_s, row)))
 
         data = [r for r in data if any(v.strip() for v in r)]
     except Exception as e:
@@ -101,26 +179,32 @@ def _read_with_openpyxl(sanitized_bio: BytesIO, logs: List[str], debug: bool = F
 
 
 def _read_with_pandas_fallback(sanitized_bio: BytesIO, logs: List[str], debug: bool = False) -> List[List[str]]:
-    """pandas 폴백을 정리된 바이트로 수행. calamine 없이도 모든 시트를 스캔해 가장 데이터 많은 시트를 선택."""
+    """
+    pandas 폴백을 정리된 바이트로 수행.
+    max_row×max_column 메타데이터는 서식만 닿은 빈 영역 때문에 과대평가될 수 있어
+    (Shopee 템플릿의 빈 스타일 시트가 데이터 시트를 이기는 사례),
+    각 시트를 파싱해 비어 있지 않은 셀 수로 점수화하고 최고 시트를 고른다.
+    파싱 결과를 들고 있다가 그대로 반환하므로 재파싱은 없다.
+    """
     try:
         sanitized_bio.seek(0)
-        df_all = pd.read_excel(
-            sanitized_bio,
-            header=None,
-            dtype=str,
-            sheet_name=None,      # 모든 시트
-            engine="openpyxl"     # calamine 없이도 동작
-        )
-        best_df = None; best_score = -1; best_name = None
-        for name, df in df_all.items():
-            df = df.fillna('')
-            score = int((df.values != '').sum())
+        xf = pd.ExcelFile(sanitized_bio, engine="openpyxl")
+        if not xf.sheet_names:
+            return []
+        best_name, best_df, best_score = None, None, -1
+        for name in xf.sheet_names:
+            try:
+                df = xf.parse(name, header=None, dtype=str).fillna('')
+            except Exception:
+                continue
+            score = int((df.to_numpy(dtype=object) != '').sum())
             if score > best_score:
-                best_score, best_df, best_name = score, df, name
-        if best_df is not None:
-            if debug:
-                logs.append(f"[DEBUG] pandas used, target sheet={best_name}, score={best_score}")
-            return best_df.values.tolist()
+                best_name, best_df, best_score = name, df, score
+        if best_df is None:
+            return []
+        if debug:
+            logs.append(f"[DEBUG] pandas used, target sheet={best_name} (non-empty cells={best_score})")
+        return best_df.values.tolist()
     except Exception as e:
         if debug:
             logs.append(f"[DEBUG] pandas fallback failed → {e}")
@@ -131,7 +215,7 @@ def read_xlsx_values(bio: BytesIO, logs: Optional[List[str]] = None, debug: bool
     """
     업로드된 XLSX BytesIO를 안정적으로 파싱하여 2D 리스트로 반환합니다.
     1) XML sanitize
-    2) openpyxl(숨김행 포함/모든 시트 점수화) → 비정상 시 pandas(all-sheets) 폴백
+    2) calamine(설치 시) → openpyxl(숨김행 포함/모든 시트 점수화) → 비정상 시 pandas(all-sheets) 폴백
     3) Shopee 메타 행 최소 제거(최대 1회씩)
     """
     if logs is None:
@@ -141,13 +225,21 @@ def read_xlsx_values(bio: BytesIO, logs: Optional[List[str]] = None, debug: bool
     if len(original_bytes) < 1024:
         logs.append(f"[DEBUG] file too small: {len(original_bytes)} bytes")
 
-    sanitized_bio = _sanitize_xlsx_for_openpyxl(original_bytes)
-
-    # 1) openpyxl
-    data = _read_with_openpyxl(sanitized_bio, logs, debug=debug)
+    # 1) calamine(설치 시) → openpyxl
+    # calamine은 openpyxl의 sheetViews/pane 검증 버그가 없으므로 원본을 그대로 읽고,
+    # sanitize(전체 unzip+rezip)는 openpyxl/pandas 폴백으로 내려갈 때만 수행한다.
+    sanitized_bio: Optional[BytesIO] = None
+    data: List[List[str]] = []
+    if CalamineWorkbook is not None:
+        data = _read_with_calamine(BytesIO(original_bytes), logs, debug=debug)
+    if not data:
+        sanitized_bio = _sanitize_xlsx_for_openpyxl(original_bytes)
+        data = _read_with_openpyxl(sanitized_bio, logs, debug=debug)
 
     # 2) 비정상이면 pandas(all-sheets)
     if not data or (len(data) == 1 and len(data[0]) <= 1):
+        if sanitized_bio is None:
+            sanitized_bio = _sanitize_xlsx_for_openpyxl(original_bytes)
         data = _read_with_pandas_fallback(sanitized_bio, logs, debug=debug)
         if not data:
             if debug:
@@ -157,11 +249,14 @@ def read_xlsx_values(bio: BytesIO, logs: Optional[List[str]] = None, debug: bool
     if debug:
         logs.append(f"[DEBUG] rows before meta-trim={len(data)}; head={data[:2]}")
 
-    # 3) Shopee 메타 최소 제거 (최대 1회씩만)
-    if data and data[0] and any(str(c).startswith('et_title_') for c in data[0]):
-        data.pop(0); logs.append("[DEBUG] trimmed header row(et_title_*) once")
-    if data and data[0] and str(data[0][0]).strip() in ('basic_info', 'media_info', 'sales_info'):
-        data.pop(0); logs.append("[DEBUG] trimmed section label row once")
+    # 3) Shopee 메타 최소 제거 (최대 1회씩만) — pop(0) 반복 대신 del data[:k] 1회
+    k = 0
+    if data and data[0] and any(c.startswith('et_title_') for c in data[0]):
+        k = 1; logs.append("[DEBUG] trimmed header row(et_title_*) once")
+    if len(data) > k and data[k] and str(data[k][0]).strip() in ('basic_info', 'media_info', 'sales_info'):
+        k += 1; logs.append("[DEBUG] trimmed section label row once")
+    if k:
+        del data[:k]
 
     # 최종 정리
     data = [r for r in data if any(v.strip() for v in r)]
@@ -172,6 +267,11 @@ def read_xlsx_values(bio: BytesIO, logs: Optional[List[str]] = None, debug: bool
 # ------------------------------------------------------
 # Google Sheet 쓰기 (API 호출 최적화)
 # ------------------------------------------------------
+
+# batchUpdate 범위당 행 수. 프로세스 시작 시 1회만 파싱 (env로 조정 가능)
+_CHUNK_ROWS = int(os.getenv("UPLOAD_CHUNK_ROWS", "5000") or "5000")
+
+
 def _write_values_to_sheet(sh: gspread.Spreadsheet, tab: str, values: List[List], logs: List[str]) -> None:
     rows = len(values)
     cols = max((len(r) for r in values), default=0)
@@ -191,11 +291,21 @@ def _write_values_to_sheet(sh: gspread.Spreadsheet, tab: str, values: List[List]
     if ws.row_count < rows or ws.col_count < cols:
         with_retry(lambda: ws.resize(rows=rows + 10, cols=cols + 5))
 
-    # [수정] 문제가 되던 chunk 로직을 제거하고, 항상 한 번에 모든 데이터를 쓰는 방식으로 변경
-    # 이렇게 하면 데이터가 많아도 단 한 번의 API 호출로 모든 쓰기가 완료됩니다.
+    # 쓰기는 항상 HTTP 1회: 작은 시트는 단일 update, 큰 시트는 10MB 요청 한도를
+    # 피하기 위해 _CHUNK_ROWS 행 범위들로 쪼개되 values.batchUpdate 한 번에 담아 보낸다.
     end_a1 = rowcol_to_a1(rows, cols)
-    # ★ API 호출 2: 데이터 전체 쓰기
-    with_retry(lambda: ws.update(f"A1:{end_a1}", values, raw=True))
+    if rows <= _CHUNK_ROWS:
+        # ★ API 호출 2: 데이터 전체 쓰기
+        with_retry(lambda: ws.update(f"A1:{end_a1}", values, raw=True))
+    else:
+        data = []
+        for start in range(0, rows, _CHUNK_ROWS):
+            chunk = values[start:start + _CHUNK_ROWS]
+            chunk_end = rowcol_to_a1(start + len(chunk), cols)
+            data.append({"range": f"{tab}!A{start + 1}:{chunk_end}", "values": chunk})
+        # ★ API 호출 2: 범위 목록 일괄 쓰기
+        with_retry(lambda: sh.values_batch_update(
+            body={"valueInputOption": "RAW", "data": data}))
 
     logs.append(f"[OK] {tab}: {rows}x{cols} 적용 완료")
 
@@ -203,15 +313,19 @@ def _write_values_to_sheet(sh: gspread.Spreadsheet, tab: str, values: List[List]
 # ------------------------------------------------------
 # 파일명 → 탭 자동 라우팅 (기존 로직 유지)
 # ------------------------------------------------------
+# 파일명 키워드 → 대상 탭 (순서 유지: basic 우선)
+_TAB_KEYS = (("basic", "BASIC"), ("media", "MEDIA"), ("sales", "SALES"))
+
+
 def _target_tab(filename: str) -> Optional[str]:
     low = filename.lower()
-    if "basic" in low:
-        return "BASIC"
-    if "media" in low:
-        return "MEDIA"
-    if "sales" in low:
-        return "SALES"
-    return None
+    return next((tab for key, tab in _TAB_KEYS if key in low), None)
+
+
+# (spreadsheet id, 탭)별로 마지막으로 반영에 성공한 파일의 해시 (프로세스 생존 동안 유지).
+# Streamlit rerun마다 같은 파일을 다시 파싱/업로드하는 낭비를 막는다.
+# 대상 시트가 설정에서 바뀌면 키가 달라지므로 새 시트에는 반드시 다시 쓴다.
+_APPLIED_DIGESTS: dict[tuple, str] = {}
 
 
 # ------------------------------------------------------
@@ -230,6 +344,13 @@ def apply_uploaded_files(files: dict[str, BytesIO]) -> list[str]:
             logs.append(f"[SKIP] 파일명 규칙 불일치: {fname}")
             continue
 
+        # 같은 내용이 이미 이 시트의 이 탭에 반영됐으면 파싱/쓰기 전부 생략
+        digest = hashlib.blake2b(raw.getvalue(), digest_size=16).hexdigest()
+        dkey = (sh.id, tab)
+        if _APPLIED_DIGESTS.get(dkey) == digest:
+            logs.append(f"[OK] {tab}: {fname} 내용 변경 없음 (재업로드 생략)")
+            continue
+
         try:
             # ★ logs를 넘겨서 read_xlsx_values의 디버그를 UI 로그에 함께 표시
             values = read_xlsx_values(raw, logs, debug=True)
@@ -242,6 +363,7 @@ def apply_uploaded_files(files: dict[str, BytesIO]) -> list[str]:
 
         try:
             _write_values_to_sheet(sh, tab, values, logs)
+            _APPLIED_DIGESTS[dkey] = digest
         except Exception as e:
             logs.append(f"[ERROR] {tab}: {fname} 반영 실패 → {e}")
 
@@ -259,7 +381,12 @@ def collect_xlsx_files(files) -> dict[str, BytesIO]:
         name = getattr(f, "name", "")
         try:
             if name.lower().endswith('.xlsx'):
-                out[name] = BytesIO(f.read())
+                if hasattr(f, "getvalue"):
+                    # Streamlit UploadedFile은 이미 BytesIO 계열 — 복사 없이 그대로 전달
+                    f.seek(0)
+                    out[name] = f
+                else:
+                    out[name] = BytesIO(f.read())
         except Exception:
             continue
     return out
@@ -10,9 +10,11 @@ from __future__ import annotations
 
 import os
 import re
+import sys
 import json
 import time
 import random
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, Callable, List
 
@@ -20,29 +22,50 @@ import gspread
 from gspread.exceptions import WorksheetNotFound
 from dotenv import load_dotenv
 
+# Streamlit은 선택 의존성 — 호출마다 import하지 않도록 모듈 로드 시 1회만 시도
+try:
+    import streamlit as _st  # type: ignore
+except Exception:
+    _st = None
+
 
 # -----------------------------
 # ENV / Secrets
 # -----------------------------
-def load_env() -> None:
-    """여러 위치에서 .env 탐색하여 로드"""
+_ENV_LOADED = False
+
+
+def load_env(force: bool = False) -> None:
+    """여러 위치에서 .env 탐색하여 로드 (프로세스당 1회 — 시트 열 때마다 stat 폭풍 방지)"""
+    global _ENV_LOADED
+    if _ENV_LOADED and not force:
+        return
     base = Path(__file__).resolve().parent
     for p in [base / ".env", base.parent / ".env", Path.cwd() / ".env"]:
         if p.exists():
             load_dotenv(p, override=True)
+            _ENV_LOADED = True
             return
     load_dotenv(override=True)  # fallback
+    _ENV_LOADED = True
 
 
 def get_env(name: str, default: str = "") -> str:
     return os.getenv(name, default).strip()
 
 
+_TRUE_SET = frozenset(("1", "true", "yes", "y"))
+_FALSE_SET = frozenset(("0", "false", "no", "n"))
+
+
 def get_bool_env(name: str, default: bool = False) -> bool:
-    v = os.getenv(name, "").strip().lower()
-    if v in ("1", "true", "yes", "y"):
+    v = os.environ.get(name)
+    if v is None:
+        return default
+    v = v.strip().lower()
+    if v in _TRUE_SET:
         return True
-    if v in ("0", "false", "no", "n"):
+    if v in _FALSE_SET:
         return False
     return default
 
@@ -88,7 +111,18 @@ def save_env_value(name: str, value: str, search_paths: Optional[List[Path]] = N
             lines.append(f"{name}={value}")
 
         env_path.parent.mkdir(parents=True, exist_ok=True)
-        env_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        # 같은 디렉터리의 임시 파일에 쓰고 os.replace로 원자적 교체
+        # (쓰기 도중 중단돼도 기존 .env가 깨지지 않음)
+        tmp_path = env_path.with_name(env_path.name + ".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        os.replace(tmp_path, env_path)
+        # load_env가 1회성 가드 뒤로 숨은 뒤로는 .env 재독이 없으므로,
+        # 저장 즉시 현재 프로세스 환경에도 반영해야 설정 변경이 바로 먹는다
+        os.environ[name] = value
+        # 키 해석/참조 시트 캐시도 무효화 — 설정 다이얼로그로 시트를 바꾸면
+        # 다음 open부터 새 키가 적용되어야 한다
+        _resolve_sheet_key.cache_clear()
+        _open_ref_cached.cache_clear()
         return True
     except Exception:
         return False
@@ -97,6 +131,26 @@ def save_env_value(name: str, value: str, search_paths: Optional[List[Path]] = N
 # -----------------------------
 # Retry (429/5xx 지수 백오프)
 # -----------------------------
+_RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+def _retry_after_seconds(resp) -> Optional[float]:
+    """응답의 Retry-After 헤더를 초 단위로 해석 (숫자/HTTP-date 모두, 없으면 None)"""
+    try:
+        ra = resp.headers.get("Retry-After") if resp is not None else None
+        if not ra:
+            return None
+        ra = ra.strip()
+        if ra.isdigit():
+            return float(ra)
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        dt = parsedate_to_datetime(ra)
+        return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+
 def with_retry(
     fn: Callable,
     retries: int = 8,
@@ -107,7 +161,7 @@ def with_retry(
     """
     gspread 호출용 재시도 래퍼
     - 429(quota/rate) 또는 500/502/503/504에서 지수 백오프 + 지터로 재시도
-    - 그 외 에러는 즉시 전파
+    - 그 외 에러(4xx 인증/권한 등)는 즉시 전파 — 영구 오류에 쿼터를 태우지 않는다
     """
     last_err = None
     delay = base_delay
@@ -116,13 +170,24 @@ def with_retry(
             return fn()
         except Exception as e:
             code = getattr(getattr(e, "response", None), "status_code", None)
-            msg = (str(e) or "").lower()
-            is_rate = (code in (429, 500, 502, 503, 504)) or ("quota" in msg) or ("rate" in msg)
+            if code is not None:
+                # 상태 코드가 있으면 그것만 믿는다 (403 등은 재시도 금지)
+                is_rate = code in _RETRYABLE_STATUS
+            else:
+                # 코드가 없는 예외(타임아웃 등)만 메시지 휴리스틱으로 판정
+                msg = (str(e) or "").lower()
+                is_rate = ("quota exceeded" in msg) or ("rate limit" in msg) or ("ratelimit" in msg)
 
             if is_rate and attempt < retries:
-                sleep_for = min(max_delay, delay + random.uniform(0, delay * 0.3))
+                # 서버가 Retry-After로 대기 시간을 알려주면 그대로 따른다
+                # (지수 램프로 과대/과소 대기하는 것보다 정확). 없으면 기존 백오프.
+                hinted = _retry_after_seconds(getattr(e, "response", None))
+                if hinted is not None:
+                    sleep_for = min(max_delay, max(base_delay, hinted) + random.uniform(0, 0.3))
+                else:
+                    sleep_for = min(max_delay, delay + random.uniform(0, delay * 0.3))
+                    delay = min(max_delay, delay * backoff)
                 time.sleep(sleep_for)
-                delay = min(max_delay, delay * backoff)
                 last_err = e
                 continue
 
@@ -134,17 +199,25 @@ def with_retry(
 # -----------------------------
 # gspread 인증 / 시트 키 해석
 # -----------------------------
+_GC_CACHE: Optional[gspread.Client] = None
+
+
 def _service_account_from_streamlit_or_env() -> Optional[gspread.Client]:
     """
     Streamlit Secrets 또는 ENV(GCP_SERVICE_ACCOUNT_JSON)의 서비스계정 JSON으로 Client 생성.
     - 둘 다 없으면 None
+    - 성공한 Client는 캐시: 시트 열 때마다 자격증명 파싱/Session 생성을 반복하지 않음
     """
+    global _GC_CACHE
+    if _GC_CACHE is not None:
+        return _GC_CACHE
+
     # 1) Streamlit Secrets
     try:
-        import streamlit as st  # type: ignore
-        if "gcp_service_account" in st.secrets:
-            creds_info = dict(st.secrets["gcp_service_account"])
-            return gspread.service_account_from_dict(creds_info)
+        if _st is not None and "gcp_service_account" in _st.secrets:
+            creds_info = dict(_st.secrets["gcp_service_account"])
+            _GC_CACHE = gspread.service_account_from_dict(creds_info)
+            return _GC_CACHE
     except Exception:
         pass
 
@@ -153,25 +226,28 @@ def _service_account_from_streamlit_or_env() -> Optional[gspread.Client]:
         env_json = os.getenv("GCP_SERVICE_ACCOUNT_JSON", "").strip()
         if env_json:
             creds_info = json.loads(env_json)
-            return gspread.service_account_from_dict(creds_info)
+            _GC_CACHE = gspread.service_account_from_dict(creds_info)
+            return _GC_CACHE
     except Exception:
         pass
 
     return None
 
 
+@lru_cache(maxsize=8)
 def _resolve_sheet_key(primary_env: str, fallback_env: Optional[str] = None) -> str:
     """
     시트 키를 secrets/ENV에서 해석. URL/키 모두 허용.
     - 우선순위: Streamlit Secrets → ENV
+    - 키는 런타임에 바뀌지 않으므로 env 이름별로 메모이즈 (미설정 예외는 캐시 안 됨)
     """
     val: Optional[str] = None
     try:
-        import streamlit as st  # type: ignore
-        if primary_env in st.secrets:
-            val = str(st.secrets.get(primary_env, "") or "").strip()
-        elif fallback_env and fallback_env in st.secrets:
-            val = str(st.secrets.get(fallback_env, "") or "").strip()
+        if _st is not None:
+            if primary_env in _st.secrets:
+                val = str(_st.secrets.get(primary_env, "") or "").strip()
+            elif fallback_env and fallback_env in _st.secrets:
+                val = str(_st.secrets.get(fallback_env, "") or "").strip()
     except Exception:
         pass
 
@@ -183,7 +259,7 @@ def _resolve_sheet_key(primary_env: str, fallback_env: Optional[str] = None) ->
     if not val:
         raise RuntimeError(f"{primary_env} (또는 {fallback_env}) 가 secrets/ENV에 설정되어 있지 않습니다.")
 
-    m = re.search(r"/spreadsheets/d/([A-Za-z0-9\-_]+)", val)
+    m = _SHEET_URL_RE.search(val)
     return m.group(1) if m else val
 
 
@@ -205,19 +281,15 @@ def open_sheet_by_env():
     return gc.open_by_key(sheet_key)
 
 
-def open_ref_by_env():
-    """
-    참조 시트(REFERENCE_SHEET_KEY)만 연다 (STRICT)
-    - 실패 시 명확한 예외 (None/폴백 금지)
-    """
-    load_env()
+@lru_cache(maxsize=4)
+def _open_ref_cached(ref_key: str):
+    """키별로 연 참조 시트를 캐시. 실패(예외)는 캐시되지 않으므로 재시도 가능."""
     gc = _service_account_from_streamlit_or_env()
     if gc is None:
         raise RuntimeError(
             "[AUTH] 서비스계정 인증 정보를 찾지 못했습니다. "
             "Streamlit Secrets 또는 GCP_SERVICE_ACCOUNT_JSON을 확인하세요."
         )
-    ref_key = _resolve_sheet_key("REFERENCE_SHEET_KEY", "REFERENCE_SPREADSHEET_ID")
     try:
         return gc.open_by_key(ref_key)
     except Exception as e:
@@ -227,13 +299,66 @@ def open_ref_by_env():
         ) from e
 
 
+def open_ref_by_env():
+    """
+    참조 시트(REFERENCE_SHEET_KEY)만 연다 (STRICT)
+    - 실패 시 명확한 예외 (None/폴백 금지)
+    - 같은 키에 대한 반복 오픈은 캐시로 해결 (파이프라인이 스텝마다 다시 열어도 API 호출 없음)
+    """
+    load_env()
+    ref_key = _resolve_sheet_key("REFERENCE_SHEET_KEY", "REFERENCE_SPREADSHEET_ID")
+    return _open_ref_cached(ref_key)
+
+
+# (spreadsheet id, 탭 이름) → Worksheet 핸들 캐시.
+# sh.worksheet(name)은 호출마다 메타데이터 RTT를 내므로 같은 탭을 여러 스텝에서
+# 다시 열 때 캐시로 해결한다. 탭이 삭제/재생성되는 경우는 이 앱에 없음(clear/resize만).
+_WS_HANDLE_CACHE: Dict[tuple, "gspread.Worksheet"] = {}
+# 탭 목록을 이미 일괄 로드한 spreadsheet id — 첫 미스에서 전체를 1회 호출로 채운다
+_WS_META_LOADED: set = set()
+
+
 def safe_worksheet(sh, name: str):
     if not sh:
         raise ValueError(f"Spreadsheet object is not valid. Cannot get worksheet '{name}'.")
+    key = (sh.id, name)
+    ws = _WS_HANDLE_CACHE.get(key)
+    if ws is not None:
+        return ws
+
+    # 첫 미스: 탭별 worksheet(name) N회 대신 worksheets() 1회로 전체 핸들을 캐시
+    if sh.id not in _WS_META_LOADED:
+        try:
+            for w in with_retry(lambda: sh.worksheets()):
+                _WS_HANDLE_CACHE[(sh.id, w.title)] = w
+            _WS_META_LOADED.add(sh.id)
+        except Exception:
+            pass
+        ws = _WS_HANDLE_CACHE.get(key)
+        if ws is not None:
+            return ws
+
     try:
-        return with_retry(lambda: sh.worksheet(name))
+        ws = with_retry(lambda: sh.worksheet(name))
     except WorksheetNotFound:
         raise
+    _WS_HANDLE_CACHE[key] = ws
+    return ws
+
+
+def evict_worksheet_cache(sh, name: Optional[str] = None) -> None:
+    """
+    캐시된 워크시트 핸들 무효화.
+    - 탭이 세션 도중 밖에서 삭제되면 캐시 핸들로의 호출이 APIError를 내므로,
+      호출자가 이걸로 캐시를 비운 뒤 safe_worksheet로 1회 재조회해 자가 치유한다.
+    """
+    sid = getattr(sh, "id", sh)
+    if name is None:
+        for k in [k for k in _WS_HANDLE_CACHE if k[0] == sid]:
+            del _WS_HANDLE_CACHE[k]
+    else:
+        _WS_HANDLE_CACHE.pop((sid, name), None)
+    _WS_META_LOADED.discard(sid)
 
 
 def get_or_create_worksheet(sh, name: str, rows: int = 100, cols: int = 26):
@@ -241,45 +366,63 @@ def get_or_create_worksheet(sh, name: str, rows: int = 100, cols: int = 26):
     if not sh:
         raise ValueError(f"Spreadsheet object is not valid. Cannot get or create worksheet '{name}'.")
     try:
-        return with_retry(lambda: sh.worksheet(name))
+        return safe_worksheet(sh, name)
     except WorksheetNotFound:
-        return with_retry(lambda: sh.add_worksheet(title=name, rows=rows, cols=cols))
+        ws = with_retry(lambda: sh.add_worksheet(title=name, rows=rows, cols=cols))
+        _WS_HANDLE_CACHE[(sh.id, name)] = ws
+        return ws
 
 
 # -----------------------------
 # 문자열/헤더 정규화 & 유틸
 # -----------------------------
+
+# 행 루프/헤더 정규화에서 반복 사용되는 패턴 — 모듈 로드 시 1회 컴파일
+_HEADER_KEY_RE = re.compile(r"[^a-z0-9\-]+")
+_SHEET_URL_RE = re.compile(r"/spreadsheets/d/([A-Za-z0-9\-_]+)")
+_SHEET_ID_RE = re.compile(r"[A-Za-z0-9\-_]{25,}")
+_CAT_ID_RE = re.compile(r"^\s*\d+\s*-\s*(.+)$")
+
+# 보이지 않는 유니코드 정리: nbsp→공백, zero-width 계열 제거 (C 레벨 1패스)
+_NORM_TABLE = str.maketrans({"\u00a0": " ", "\u200b": "", "\u200c": "", "\u200d": ""})
+
+
 def norm(s: str) -> str:
-    return (
-        str(s or "")
-        .strip()
-        .lower()
-        .replace("\u00a0", " ")
-        .replace("\u200b", "")
-        .replace("\u200c", "")
-        .replace("\u200d", "")
-    )
+    return str(s or "").translate(_NORM_TABLE).strip().lower()
 
 
+@lru_cache(maxsize=4096)
 def header_key(s: str) -> str:
-    """헤더 비교용: 영숫자+하이픈만 남김"""
-    return re.sub(r"[^a-z0-9\-]+", "", norm(s))
+    """
+    헤더 비교용: 영숫자+하이픈만 남김 (intern으로 동일 키 비교를 포인터 비교로)
+    - 핫루프에서 같은 헤더 문자열에 수십만 번 호출되므로 lru_cache로 메모이즈.
+      유니크 헤더 수는 수백 개 수준이라 워밍업 후 사실상 100% 히트.
+    """
+    return sys.intern(_HEADER_KEY_RE.sub("", norm(s)))
+
+
+_INV255 = 1.0 / 255.0
 
 
+@lru_cache(maxsize=256)
 def hex_to_rgb01(hex_str: str) -> Dict[str, float]:
-    """#RRGGBB → {red,green,blue} (0~1 float)"""
-    hex_str = hex_str.lstrip("#")
-    if len(hex_str) != 6:
+    """#RRGGBB → {red,green,blue} (0~1 float) — 팔레트가 작아 캐시 적중률이 높다"""
+    h = hex_str.lstrip("#")
+    if len(h) != 6:
         return {"red": 1, "green": 1, "blue": 0.7}
-    r, g, b = tuple(int(hex_str[i : i + 2], 16) for i in (0, 2, 4))
-    return {"red": r / 255.0, "green": g / 255.0, "blue": b / 255.0}
+    v = int(h, 16)
+    return {
+        "red": ((v >> 16) & 0xFF) * _INV255,
+        "green": ((v >> 8) & 0xFF) * _INV255,
+        "blue": (v & 0xFF) * _INV255,
+    }
 
 
 def extract_sheet_id(s: str) -> str | None:
     s = (s or "").strip()
-    if re.fullmatch(r"[A-Za-z0-9\-_]{25,}", s):
+    if _SHEET_ID_RE.fullmatch(s):
         return s
-    m = re.search(r"/spreadsheets/d/([A-Za-z0-9\-_]+)", s)
+    m = _SHEET_URL_RE.search(s)
     if m:
         return m.group(1)
     return None
@@ -295,25 +438,25 @@ def sheet_link(sid: str) -> str:
 def strip_category_id(cat: str) -> str:
     """ '101814 - Home & Living/...' -> 'Home & Living/...' """
     s = str(cat or "")
-    m = re.match(r"^\s*\d+\s*-\s*(.+)$", s)
+    m = _CAT_ID_RE.match(s)
     return m.group(1) if m else s
 
 
+# 카테고리 구분자들을 '/'로 통일 — 분리자 4종 순회 대신 C 레벨 1패스
+_CAT_SEP_TABLE = str.maketrans({">": "/", "|": "/", "\\": "/"})
+
+
 def top_of_category(cat: str) -> Optional[str]:
-    """ TopLevel 추출 (구분자: '/', '>', '|', '\\') """
+    """ TopLevel 추출 (구분자: '/', '>', '|', '\\' — 가장 앞에 오는 것 기준) """
     if not cat:
         return None
-    tail = strip_category_id(cat)
-    for sep in ["/", ">", "|", "\\"]:
-        if sep in tail:
-            tail = tail.split(sep, 1)[0]
-            break
-    tail = tail.strip()
+    tail = strip_category_id(cat).translate(_CAT_SEP_TABLE).split("/", 1)[0].strip()
     return tail.lower() if tail else None
 
 
 # -----------------------------
 # TEM 시트명
 # -----------------------------
+@lru_cache(maxsize=1)
 def get_tem_sheet_name() -> str:
     return get_env("TEM_OUTPUT_SHEET_NAME", "TEM_OUTPUT")